@@ -0,0 +1,105 @@
+"""
+This script precomputes the reference k-space of the quality benchmark for several
+trajectories, in parallel worker processes.
+
+The k-space of the reference image is simulated with a high precision finufft
+operator, and stored in the cache of the quality benchmark (keyed on the content of
+the trajectory and the reference image, the precision and the number of coils), so
+that `20_benchmark_quality.py` finds it instead of simulating it serially.
+
+Usage:
+    python 15_reference_kspace.py trajs/floret_256x256x176_0.5.bin trajs/seiffert_256x256x176_0.5.bin --workers 2
+
+Output:
+    The k-space files in '<cache-dir>/ksp'.
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from utils import REF_EPS, load_trajectory, reference_kspace
+
+
+def get_parser():
+    """
+    Create and return an argument parser for the script.
+
+    """
+    parser = argparse.ArgumentParser(
+        description="Precompute the reference k-space of the quality benchmark."
+    )
+    parser.add_argument(
+        "trajectories", type=str, nargs="+", help="Trajectory files (.bin)."
+    )
+    parser.add_argument(
+        "--ref-data", type=str, default="cpx_cartesian.npy", help="Reference image."
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default="cache-quality",
+        help="Cache directory of the quality benchmark.",
+    )
+    parser.add_argument(
+        "--eps", type=float, default=REF_EPS, help="Precision of the simulation."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=2,
+        help="Number of worker processes, each one simulating one trajectory.",
+    )
+    return parser
+
+
+def precompute(trajectory_file, ref_file, cache_dir, eps, nthreads):
+    """Simulate and cache the reference k-space of one trajectory."""
+    trajectory, params = load_trajectory(
+        trajectory_file, dtype=np.float32, cachedir=Path(cache_dir) / "trajs"
+    )
+    ref_data = np.load(ref_file, mmap_mode="r")
+    if ref_data.shape != tuple(params["img_size"]):
+        raise ValueError(f"shape mismatch between {ref_file} and {trajectory_file}.")
+    reference_kspace(
+        trajectory,
+        ref_data,
+        eps=eps,
+        n_coils=1,
+        cachedir=Path(cache_dir) / "ksp",
+        nthreads=nthreads,
+    )
+    return trajectory_file
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+
+    # Share the CPUs among the workers.
+    nthreads = max(1, len(os.sched_getaffinity(0)) // args.workers)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(
+                precompute,
+                trajectory,
+                args.ref_data,
+                args.cache_dir,
+                args.eps,
+                nthreads,
+            )
+            for trajectory in args.trajectories
+        ]
+        failed = []
+        for trajectory, future in zip(args.trajectories, futures):
+            try:
+                future.result()
+                print(f"{trajectory} done.")
+            except Exception as exc:
+                print(f"{trajectory} failed: {exc}")
+                failed.append(trajectory)
+    if failed:
+        sys.exit(1)
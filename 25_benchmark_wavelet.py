@@ -0,0 +1,101 @@
+"""
+Benchmark the multi-coil wavelet transform used by the quality benchmark.
+
+This script compares the batched path of ``WaveletTransform`` (all the coils
+transformed in a single vectorized call) with the joblib path (one task per
+coil) for several numbers of coils, on the forward and adjoint operations.
+With a single coil, both paths use the plain single-coil transform.
+
+Usage:
+    python 25_benchmark_wavelet.py shape_dim1 shape_dim2 [shape_dim3] --coils 1 8 32
+
+Output:
+    Median time of each path printed, and optionally saved in a CSV file.
+"""
+
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from solver_utils import WaveletTransform
+
+
+def get_parser():
+    """
+    Create and return an argument parser for the script.
+
+    """
+    parser = argparse.ArgumentParser(
+        description="Compare the batched and joblib multi-coil wavelet transforms."
+    )
+    parser.add_argument(
+        "shape", type=int, nargs="+", default=[256, 256], help="Shape of the image."
+    )
+    parser.add_argument(
+        "--coils", type=int, nargs="+", default=[1, 8, 32], help="Number of coils."
+    )
+    parser.add_argument("--wavelet", type=str, default="sym8", help="Wavelet name.")
+    parser.add_argument("--level", type=int, default=4, help="Number of scales.")
+    parser.add_argument(
+        "--n-jobs", type=int, default=-1, help="Number of jobs of the joblib path."
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of timed repetitions."
+    )
+    parser.add_argument("--output", type=str, default=None, help="CSV output file.")
+    return parser
+
+
+def time_call(fun, arg, repeat):
+    """Return the median run time of ``fun(arg)`` after one warm-up call."""
+    fun(arg)
+    times = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        fun(arg)
+        times.append(time.perf_counter() - tic)
+    return np.median(times)
+
+
+if __name__ == "__main__":
+    parser = get_parser()
+    args = parser.parse_args()
+    shape = tuple(args.shape)
+    rng = np.random.default_rng(0)
+
+    rows = []
+    for n_coils in args.coils:
+        data_shape = (n_coils, *shape) if n_coils > 1 else shape
+        data = rng.standard_normal(data_shape, dtype=np.float32) * 1j
+        data += rng.standard_normal(data_shape, dtype=np.float32)
+        for batched in [True, False]:
+            linear_op = WaveletTransform(
+                wavelet_name=args.wavelet,
+                shape=shape,
+                level=args.level,
+                n_coils=n_coils,
+                n_jobs=args.n_jobs,
+                mode="periodization",
+                batched=batched,
+            )
+            coeffs = linear_op.op(data)
+            row = {
+                "path": "batched" if batched else "joblib",
+                "n_coils": n_coils,
+                "shape": shape,
+                "forward": time_call(linear_op.op, data, args.repeat),
+                "adjoint": time_call(linear_op.adj_op, coeffs, args.repeat),
+            }
+            print(
+                f"{row['path']:>8} n_coils={n_coils:<3} "
+                f"forward: {row['forward']:.4f}s adjoint: {row['adjoint']:.4f}s"
+            )
+            rows.append(row)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            writer = csv.DictWriter(f, fieldnames=rows[0].keys())
+            writer.writeheader()
+            writer.writerows(rows)
@@ -1,5 +1,6 @@
 """
-This script generates benchmark plots from CSV files containing performance metrics.
+This script generates benchmark plots from the result files (Parquet, npy or CSV)
+containing performance metrics.
 
 The generated plots are saved as a PNG file with the specified filename.
 
@@ -8,12 +9,13 @@ Usage:
 """
 
 import argparse
-import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import matplotlib
 import glob
 
+from results_utils import load_results
+
 sns.set_theme()
 
 # Parse command-line arguments
@@ -27,10 +29,43 @@ args = parser.parse_args()
 
 # Directory where benchmark result files are stored
 BENCHMARK_DIR = "./outputs"
-results_files = glob.glob(BENCHMARK_DIR + "/CPU/**/*.csv", recursive=True)
-
-# Read and concatenate all CSV files into a single DataFrame
-df = pd.concat(map(pd.read_csv, results_files))
+results_files = [
+    f
+    for ext in ("parquet", "npy", "csv")
+    for f in glob.glob(BENCHMARK_DIR + f"/CPU/**/*.{ext}", recursive=True)
+]
+
+# Read only the needed columns of all the results files into a single DataFrame
+df = load_results(
+    results_files,
+    columns=[
+        "backend",
+        "task",
+        "n_coils",
+        "mode",
+        "phase",
+        "row_type",
+        "warmup",
+        "run_time",
+        "mem_peak",
+        "mem_hwm",
+        "gpu0_mem_GiB_peak",
+    ],
+)
+if "gpu0_mem_GiB_peak" not in df.columns:
+    df["gpu0_mem_GiB_peak"] = 0.0
+# Prefer the exact peak memory to the sampled one, when it was measured.
+if "mem_hwm" in df.columns:
+    df["mem_peak"] = df["mem_hwm"].fillna(df["mem_peak"])
+
+# Keep the raw runs, without the warm-up ones.
+if "row_type" in df.columns:
+    df = df[(df["row_type"] != "summary") & (df["warmup"] != True)]  # noqa: E712
+
+# Keep the steady-state runs of the operator-reuse mode, if any.
+if "phase" in df.columns:
+    first_reuse = (df["mode"] == "reuse") & (df["phase"] == "first")
+    df = df[(df["phase"] != "setup") & ~first_reuse]
 
 # Calculate additional metrics
 df["coil_time"] = df["run_time"] / df["n_coils"]
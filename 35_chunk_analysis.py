@@ -0,0 +1,109 @@
+"""
+This script plots the throughput versus peak memory of the coil-chunked benchmarks,
+as a function of the coil chunk size (see the ``data.coil_chunk`` option).
+
+For each backend and task, the summary rows of the runs are used: the throughput
+is the number of coil samples processed per second (n_coils * n_samples / run time),
+and the memory is the peak RAM (or GPU memory, with ``--gpu``): the exact high-water
+mark ``mem_hwm`` when it was measured, the sampled ``mem_peak`` otherwise.
+The table of the curves is printed and saved as a CSV file next to the figure.
+
+Usage:
+    python 35_chunk_analysis.py <output_filename> [--results-dir ./outputs/sweep]
+"""
+
+import argparse
+import glob
+
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+from results_utils import load_results
+
+sns.set_theme()
+
+# Parse command-line arguments
+parser = argparse.ArgumentParser(
+    description="Plot the throughput versus peak memory of the coil chunk sizes."
+)
+parser.add_argument(
+    "output_filename", type=str, help="Name of the output file (without extension)."
+)
+parser.add_argument(
+    "--results-dir",
+    type=str,
+    default="./outputs/sweep",
+    help="Directory where the benchmark result files are stored.",
+)
+parser.add_argument(
+    "--gpu", action="store_true", help="Use the peak GPU memory instead of the RAM."
+)
+args = parser.parse_args()
+
+results_files = [
+    f
+    for ext in ("parquet", "npy")
+    for f in glob.glob(args.results_dir + f"/**/*.{ext}", recursive=True)
+]
+mem_keys = ["gpu0_mem_GiB_peak"] if args.gpu else ["mem_hwm", "mem_peak"]
+df = load_results(
+    results_files,
+    columns=[
+        "backend",
+        "task",
+        "n_coils",
+        "n_samples",
+        "coil_chunk",
+        "mode",
+        "phase",
+        "row_type",
+        "run_time",
+        *mem_keys,
+    ],
+)
+# The exact peak RAM when it was measured, the sampled one otherwise.
+mem_key = next(k for k in mem_keys if k in df.columns)
+if mem_key == "mem_hwm":
+    df["mem_hwm"] = df["mem_hwm"].fillna(df["mem_peak"])
+
+# Keep the summary rows of the steady-state runs.
+df = df[(df["row_type"] == "summary") & (df["task"] != "setup")]
+df = df[(df["mode"] == "rebuild") | (df["phase"] == "steady")]
+
+df["throughput"] = df["n_coils"] * df["n_samples"] / df["run_time"]
+df = df.sort_values(["backend", "task", "n_coils", "coil_chunk"])
+
+table = df[
+    ["backend", "task", "n_coils", "coil_chunk", "run_time", "throughput", mem_key]
+]
+print(table.to_string(index=False))
+table.to_csv(f"{args.output_filename}.csv", index=False)
+
+tasks = ["forward", "adjoint", "grad"]
+fig, axs = plt.subplots(1, len(tasks), figsize=(16, 5), sharey=True)
+for ax, task in zip(axs, tasks):
+    ddf = df[df["task"] == task]
+    sns.lineplot(
+        ddf,
+        x=mem_key,
+        y="throughput",
+        hue="backend",
+        style="n_coils",
+        marker="o",
+        sort=False,
+        ax=ax,
+    )
+    for _, row in ddf.iterrows():
+        ax.annotate(
+            str(row["coil_chunk"]),
+            (row[mem_key], row["throughput"]),
+            textcoords="offset points",
+            xytext=(4, 4),
+            fontsize=7,
+        )
+    ax.set_title(task)
+    ax.set_xlabel("Peak GPU Mem (GB)" if args.gpu else "Peak RAM (GB)")
+axs[0].set_ylabel("Throughput (coil samples / s)")
+
+plt.savefig(f"{args.output_filename}.png")
+plt.show()
@@ -0,0 +1,108 @@
+"""
+This script fits the cost models of each backend and task on the results of the
+scaling suite (`auto_benchmark_scaling.py`), and predicts the run time and peak
+memory of untested protocols.
+
+Time per coil is modeled as a*K + b*N*log(N) + c, and the peak memory as
+a*C*K + b*C*N + c, with K samples, N points of the oversampled grid and C coils
+(see `scaling_utils.py`).
+
+Usage:
+    python 36_scaling_fit.py <output_filename> [--predict 256 256 176 --n-samples 4000000 --n-coils 32]
+
+Output:
+    The fitted coefficients in <output_filename>.csv, the measured versus fitted
+    values in <output_filename>.png, and the predictions printed.
+"""
+
+import argparse
+import glob
+
+import matplotlib.pyplot as plt
+import numpy as np
+import seaborn as sns
+
+from results_utils import load_results
+from scaling_utils import MODELS, cost_features, fit_scaling, grid_size, predict
+
+sns.set_theme()
+
+parser = argparse.ArgumentParser(
+    description="Fit the cost models on the scaling suite results."
+)
+parser.add_argument(
+    "output_filename", type=str, help="Name of the output files (without extension)."
+)
+parser.add_argument(
+    "--results-dir",
+    type=str,
+    default="./outputs/scaling",
+    help="Directory where the benchmark result files are stored.",
+)
+parser.add_argument(
+    "--predict", type=int, nargs="+", default=None, help="Image shape to predict."
+)
+parser.add_argument("--n-samples", type=int, default=None, help="Samples to predict.")
+parser.add_argument("--n-coils", type=int, default=1, help="Coils to predict.")
+parser.add_argument(
+    "--upsampfac", type=float, default=2.0, help="Oversampling factor to predict."
+)
+args = parser.parse_args()
+
+results_files = [
+    f
+    for ext in ("parquet", "npy")
+    for f in glob.glob(args.results_dir + f"/**/*.{ext}", recursive=True)
+]
+df = load_results(
+    results_files,
+    columns=[
+        "backend",
+        "task",
+        "shape",
+        "n_samples",
+        "n_coils",
+        "upsampfac",
+        "mode",
+        "phase",
+        "row_type",
+        "run_time",
+        "mem_peak",
+    ],
+)
+# Keep the summary rows of the steady-state runs.
+df = df[(df["row_type"] == "summary") & (df["task"] != "setup")]
+df = df[(df["mode"] == "rebuild") | (df["phase"] == "steady")]
+
+fits = fit_scaling(df)
+print(fits.to_string(index=False))
+fits.to_csv(f"{args.output_filename}.csv", index=False)
+
+# Measured versus fitted values
+fig, axs = plt.subplots(1, len(MODELS), figsize=(12, 5))
+for ax, (model, (target, names)) in zip(axs, MODELS.items()):
+    for (backend, task), group in df.groupby(["backend", "task"]):
+        fit = fits[
+            (fits["backend"] == backend)
+            & (fits["task"] == task)
+            & (fits["model"] == model)
+        ].iloc[0]
+        n_grid = [grid_size(s, u) for s, u in zip(group["shape"], group["upsampfac"])]
+        X = cost_features(group["n_samples"], n_grid, group["n_coils"], model)
+        fitted = X @ fit[list(names)].to_numpy(dtype=float)
+        ax.scatter(group[target], fitted, label=f"{backend} {task}", s=12)
+    lims = np.array(ax.get_xlim())
+    ax.plot(lims, lims, "k--", lw=1)
+    ax.set_xlabel(f"measured {target}")
+    ax.set_ylabel(f"fitted {target}")
+    ax.set_title(model)
+axs[0].legend(fontsize=7)
+plt.savefig(f"{args.output_filename}.png")
+
+if args.predict is not None:
+    if args.n_samples is None:
+        parser.error("--n-samples is required with --predict.")
+    predictions = predict(
+        fits, tuple(args.predict), args.n_samples, args.n_coils, args.upsampfac
+    )
+    print(predictions.to_string(index=False))
@@ -0,0 +1,112 @@
+"""
+This script computes the strong-scaling curves of the thread-scaling benchmarks
+(`auto_benchmark_threads.py`): the speedup and the parallel efficiency of each
+backend and task as a function of the thread count.
+
+The speedup is relative to the smallest thread count n0 of each group,
+S(n) = n0 * T(n0) / T(n), and the efficiency is E(n) = S(n) / n.
+The saturation point is the largest thread count with an efficiency above the
+threshold.
+
+Usage:
+    python 37_thread_scaling.py <output_filename> [--results-dir ./outputs/threads]
+
+Output:
+    The curves in <output_filename>.csv and <output_filename>.png, and the saturation
+    points printed.
+"""
+
+import argparse
+import glob
+
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+from results_utils import load_results
+
+sns.set_theme()
+
+parser = argparse.ArgumentParser(description="Plot the thread-scaling curves.")
+parser.add_argument(
+    "output_filename", type=str, help="Name of the output files (without extension)."
+)
+parser.add_argument(
+    "--results-dir",
+    type=str,
+    default="./outputs/threads",
+    help="Directory where the benchmark result files are stored.",
+)
+parser.add_argument(
+    "--efficiency-threshold",
+    type=float,
+    default=0.5,
+    help="Parallel efficiency below which a backend is saturated.",
+)
+args = parser.parse_args()
+
+results_files = [
+    f
+    for ext in ("parquet", "npy")
+    for f in glob.glob(args.results_dir + f"/**/*.{ext}", recursive=True)
+]
+df = load_results(
+    results_files,
+    columns=[
+        "backend",
+        "trajectory",
+        "task",
+        "n_coils",
+        "n_threads",
+        "mode",
+        "phase",
+        "row_type",
+        "run_time",
+    ],
+)
+# Keep the summary rows of the steady-state runs.
+df = df[(df["row_type"] == "summary") & (df["task"] != "setup")]
+df = df[(df["mode"] == "rebuild") | (df["phase"] == "steady")]
+df = df.sort_values("n_threads")
+
+group_keys = ["backend", "trajectory", "task", "n_coils"]
+ref = df.groupby(group_keys).first()
+ref_time = df.join(ref[["n_threads", "run_time"]], on=group_keys, rsuffix="_ref")
+df["speedup"] = (
+    ref_time["n_threads_ref"] * ref_time["run_time_ref"] / ref_time["run_time"]
+)
+df["efficiency"] = df["speedup"] / df["n_threads"]
+
+table = df[group_keys + ["n_threads", "run_time", "speedup", "efficiency"]]
+print(table.to_string(index=False))
+table.to_csv(f"{args.output_filename}.csv", index=False)
+
+# Saturation point of each backend and task
+efficient = df[df["efficiency"] >= args.efficiency_threshold]
+saturation = efficient.groupby(group_keys)["n_threads"].max()
+print(f"\nLargest thread count with an efficiency >= {args.efficiency_threshold}:")
+print(saturation.to_string())
+
+tasks = ["forward", "adjoint", "grad"]
+fig, axs = plt.subplots(2, len(tasks), figsize=(16, 9), sharex=True, sharey="row")
+for col, task in zip(axs.T, tasks):
+    ddf = df[df["task"] == task]
+    for ax, metric in zip(col, ["speedup", "efficiency"]):
+        sns.lineplot(
+            ddf,
+            x="n_threads",
+            y=metric,
+            hue="backend",
+            style="n_coils",
+            marker="o",
+            ax=ax,
+        )
+    max_threads = df["n_threads"].max()
+    col[0].plot([1, max_threads], [1, max_threads], "k--", lw=1, label="ideal")
+    col[1].axhline(args.efficiency_threshold, color="k", ls=":", lw=1)
+    col[0].set_title(task)
+    col[1].set_xlabel("# threads")
+axs[0, 0].set_ylabel("Speedup")
+axs[1, 0].set_ylabel("Parallel efficiency")
+
+plt.savefig(f"{args.output_filename}.png")
+plt.show()
@@ -0,0 +1,107 @@
+"""
+This script detects the performance regressions of new benchmark results against
+a stored baseline, e.g. after upgrading mri-nufft or a backend.
+
+The runs are matched by (backend, trajectory, task, n_coils, eps, upsampfac). For
+each configuration, the run times and peak memory of the runs are compared with a
+Mann-Whitney U test: a regression is a significant increase of the median larger
+than the threshold of the metric. Only the Parquet and npy results are read, the
+legacy CSV results do not have the columns of the runs.
+
+Usage:
+    python 38_perf_regression.py --save-baseline baseline.parquet [--results-dir ./outputs]
+    python 38_perf_regression.py --baseline baseline.parquet [--results-dir ./outputs]
+        [--time-threshold 0.1] [--memory-threshold 0.1] [--alpha 0.05] [--output report.csv]
+
+Output:
+    The report printed (and saved in the CSV output), with the regressions and
+    improvements listed at the end. The exit code is 1 if there is a regression.
+"""
+
+import argparse
+import glob
+import sys
+
+import pandas as pd
+
+from regression_utils import COLUMNS, compare_runs, timed_runs
+from results_utils import load_results, read_results
+
+parser = argparse.ArgumentParser(description="Compare benchmark results to a baseline.")
+parser.add_argument(
+    "--results-dir",
+    type=str,
+    default="./outputs",
+    help="Directory where the new benchmark result files are stored.",
+)
+group = parser.add_mutually_exclusive_group(required=True)
+group.add_argument(
+    "--baseline", type=str, help="Baseline runs, saved with --save-baseline."
+)
+group.add_argument(
+    "--save-baseline",
+    type=str,
+    help="Save the runs of the results directory as the baseline (Parquet or CSV).",
+)
+parser.add_argument(
+    "--time-threshold",
+    type=float,
+    default=0.1,
+    help="Smallest relative change of the median run time reported.",
+)
+parser.add_argument(
+    "--memory-threshold",
+    type=float,
+    default=0.1,
+    help="Smallest relative change of the median peak memory reported.",
+)
+parser.add_argument(
+    "--alpha", type=float, default=0.05, help="Significance level of the test."
+)
+parser.add_argument(
+    "--min-runs",
+    type=int,
+    default=3,
+    help="Minimum number of runs of a configuration on each side for a test.",
+)
+parser.add_argument("--output", type=str, default=None, help="CSV report file.")
+args = parser.parse_args()
+
+# The legacy CSV results have no trajectory, row type nor warm-up columns.
+results_files = [
+    f
+    for ext in ("parquet", "npy")
+    for f in glob.glob(args.results_dir + f"/**/*.{ext}", recursive=True)
+]
+if not results_files:
+    raise SystemExit(f"No results files in {args.results_dir}.")
+current = timed_runs(load_results(results_files, columns=COLUMNS))
+
+if args.save_baseline:
+    if args.save_baseline.endswith(".csv"):
+        current.to_csv(args.save_baseline, index=False)
+    else:
+        current.to_parquet(args.save_baseline, index=False)
+    print(f"Saved {len(current)} runs of {len(results_files)} files as baseline.")
+    sys.exit(0)
+
+baseline = read_results(args.baseline)
+report = compare_runs(
+    baseline,
+    current,
+    thresholds={"run_time": args.time_threshold, "memory": args.memory_threshold},
+    alpha=args.alpha,
+    min_runs=args.min_runs,
+)
+
+with pd.option_context("display.float_format", "{:.4g}".format):
+    print(report.to_string(index=False))
+    for status in ("improvement", "regression"):
+        changes = report[report["status"] == status]
+        print(f"\n{len(changes)} {status}(s)")
+        if len(changes):
+            print(changes.to_string(index=False))
+if args.output:
+    report.to_csv(args.output, index=False)
+
+sys.exit(int((report["status"] == "regression").any()))
@@ -0,0 +1,55 @@
+"""
+This script compares the density compensation methods of the quality benchmarks:
+cost of the estimation (run time, peak memory) versus quality of the reconstruction.
+
+Run the quality benchmark with several methods first, e.g.
+    python 20_benchmark_quality.py -m trajectory.density=voronoi,pipe,cell_count trajectory.density_kwargs.backend=finufft
+
+Usage:
+    python 41_density_analysis.py [--results-dir ./outputs-qual] [--output density.csv]
+
+Output:
+    The comparison table printed, and optionally saved in a CSV file.
+"""
+
+import argparse
+import glob
+import json
+
+import pandas as pd
+
+parser = argparse.ArgumentParser(description="Compare the density methods.")
+parser.add_argument(
+    "--results-dir",
+    type=str,
+    default="./outputs-qual",
+    help="Directory where the quality result files are stored.",
+)
+parser.add_argument("--output", type=str, default=None, help="CSV output file.")
+args = parser.parse_args()
+
+rows = []
+for file in glob.glob(args.results_dir + "/**/results_*.json", recursive=True):
+    with open(file) as f:
+        rows.append(json.load(f))
+df = pd.DataFrame(rows)
+if "density" not in df.columns:
+    raise SystemExit("No density information in the results.")
+
+columns = [
+    "trajectory",
+    "backend",
+    "density",
+    "density_run_time",
+    "density_mem_hwm",
+    "density_mem_delta",
+    "run_time",
+    "end_ssim",
+    "end_snr",
+]
+df = df[[c for c in columns if c in df.columns]]
+df = df.groupby(["trajectory", "backend", "density"], as_index=False).median()
+df = df.sort_values(["trajectory", "backend", "density"])
+print(df.to_string(index=False))
+if args.output:
+    df.to_csv(args.output, index=False)
@@ -0,0 +1,60 @@
+"""
+This script builds the time-to-target-quality table of the quality benchmarks:
+for each trajectory, backend, eps and upsampfac, the solver time needed to reach
+each SSIM/SNR target (see the `convergence` section of the quality configuration).
+
+Usage:
+    python 42_time_to_quality.py [--results-dir ./outputs-qual] [--output time_to_quality.csv]
+
+Output:
+    The table printed (NaN when the target is never reached), and optionally saved
+    in a CSV file.
+"""
+
+import argparse
+import glob
+import json
+
+import pandas as pd
+
+parser = argparse.ArgumentParser(description="Time to reach the quality targets.")
+parser.add_argument(
+    "--results-dir",
+    type=str,
+    default="./outputs-qual",
+    help="Directory where the quality result files are stored.",
+)
+parser.add_argument("--output", type=str, default=None, help="CSV output file.")
+args = parser.parse_args()
+
+rows = []
+for file in glob.glob(args.results_dir + "/**/results_*.json", recursive=True):
+    with open(file) as f:
+        results = json.load(f)
+    if "convergence" not in results:
+        continue
+    for target in results["convergence"]["time_to_target"]:
+        rows.append(
+            {
+                "trajectory": results["trajectory"],
+                "backend": results["backend"],
+                "eps": results["eps"],
+                "upsampfac": results["upsampfac"],
+                "target": f"{target['metric']}>={target['target']}",
+                "time": target["time"],
+            }
+        )
+if not rows:
+    raise SystemExit("No convergence records in the results.")
+
+df = pd.DataFrame(rows)
+table = df.pivot_table(
+    index=["trajectory", "backend", "eps", "upsampfac"],
+    columns="target",
+    values="time",
+    aggfunc="median",
+    dropna=False,
+)
+print(table.to_string())
+if args.output:
+    table.to_csv(args.output)
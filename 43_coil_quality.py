@@ -0,0 +1,85 @@
+"""
+This script compares the multi-coil (SENSE) quality benchmarks: for each backend
+and number of coils, the time of one solver iteration and the peak memory, next
+to the final SSIM/SNR of the reconstruction.
+
+Usage:
+    python 43_coil_quality.py <output_filename> [--results-dir ./outputs-qual]
+
+Output:
+    The table printed and saved in <output_filename>.csv, and the iteration time
+    and peak memory against the number of coils in <output_filename>.png.
+"""
+
+import argparse
+import glob
+import json
+
+import matplotlib.pyplot as plt
+import pandas as pd
+import seaborn as sns
+
+sns.set_theme()
+
+parser = argparse.ArgumentParser(description="Cost of the coils in the solvers.")
+parser.add_argument(
+    "output_filename", type=str, help="Name of the output files (without extension)."
+)
+parser.add_argument(
+    "--results-dir",
+    type=str,
+    default="./outputs-qual",
+    help="Directory where the quality result files are stored.",
+)
+args = parser.parse_args()
+
+rows = []
+for file in glob.glob(args.results_dir + "/**/results_*.json", recursive=True):
+    with open(file) as f:
+        results = json.load(f)
+    if "iteration_time" not in results:
+        continue
+    rows.append(
+        {
+            "trajectory": results["trajectory"],
+            "backend": results["backend"],
+            "eps": results["eps"],
+            "upsampfac": results["upsampfac"],
+            "n_coils": results.get("n_coils", 1),
+            "iteration_time": results["iteration_time"],
+            # Exact peak when it is measured, else the sampled one.
+            "mem_peak": results.get("mem_hwm", results["mem_peak"]),
+            "end_ssim": results["end_ssim"],
+            "end_snr": results["end_snr"],
+        }
+    )
+if not rows:
+    raise SystemExit("No iteration time in the results.")
+
+df = pd.DataFrame(rows)
+table = (
+    df.groupby(["trajectory", "backend", "eps", "upsampfac", "n_coils"])
+    .median()
+    .reset_index()
+)
+print(table.to_string(index=False))
+table.to_csv(f"{args.output_filename}.csv", index=False)
+
+fig, axs = plt.subplots(1, 2, figsize=(12, 5), sharex=True)
+for ax, metric, label in zip(
+    axs, ["iteration_time", "mem_peak"], ["Time per iteration (s)", "Peak memory (GiB)"]
+):
+    sns.lineplot(
+        table,
+        x="n_coils",
+        y=metric,
+        hue="backend",
+        style="trajectory",
+        marker="o",
+        ax=ax,
+    )
+    ax.set_xlabel("# coils")
+    ax.set_ylabel(label)
+
+plt.savefig(f"{args.output_filename}.png")
+plt.show()
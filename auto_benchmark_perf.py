@@ -5,22 +5,48 @@ executes the benchmarking script, and cleans up temporary configuration files.
 Usage:
     1. Ensure that all necessary backends are installed and accessible.
     2. Run 'python auto_benchmark_perf.py'
+    3. Use 'python auto_benchmark_perf.py --slots N' to run N benchmarks at the same time.
+    4. Or 'python auto_benchmark_perf.py --fork' to run them in forked children of a
+       single process, which loads the trajectories and smaps once.
 
 The script performs the following tasks:
     - Reads a base configuration file (`benchmark_config.yaml`) that defines default settings.
-    - Generates all combinations of backend names, trajectories, and number of coils specified.
+    - Generates all combinations of backend names, trajectories, number of coils
+      and coil chunk sizes specified.
     - For each combination, it creates a temporary YAML configuration file.
-    - Calls the benchmark script with the generated configuration.
-    - Cleans up by deleting all temporary configuration files after execution.
+    - Calls the benchmark script with the generated configuration. With several slots,
+      the benchmarks run concurrently, each pinned to a disjoint set of CPUs with
+      matching thread-count environment variables. GPU backends always run alone.
+    - Records the status of each run in a SQLite manifest, keyed on the hash of its
+      configuration: rerunning the script skips the completed runs and retries the
+      failed ones up to '--max-attempts'. Each run writes in '<output-dir>/<hash>'.
+    - Cleans up by deleting the temporary configuration files of the completed runs.
+
+    With '--fork', no interpreter is started per benchmark: the inputs shared by the
+    configurations are loaded once, then each benchmark runs in a forked child (one at
+    a time) which inherits them copy-on-write, writes its results like a subprocess run
+    and exits, so the memory measurements stay isolated. The inputs are converted in a
+    first child, so that the parent never imports mrinufft: each benchmark imports it
+    after the fork, with only the frameworks of its backend. The 'startup_time' of
+    these runs is the time since the fork. Same manifest and output directories as the
+    subprocess runs.
 
 Note:
     The benchmark script should be designed to accept a configuration file path as an argument.
 """
 
+import argparse
+import copy
 import itertools
-import subprocess
+import logging
+import sys
+
 import yaml
-import os
+from omegaconf import OmegaConf
+
+from sweep_utils import run_forked, run_forked_sweep, run_sweep
+
+logger = logging.getLogger(__name__)
 
 # Define parameter lists and dependencies to install before running this script
 backend_names = [  # mrinufft of course
@@ -39,43 +65,126 @@ trajectories = [
     # "./trajs/stack2D_of_spiral_256x256_0.5.bin"
 ]
 n_coils_list = [12]
+# None processes all the coils at once, see the data.coil_chunk option.
+coil_chunks = [None]
 
-# Read the base configuration file to copy from
-with open("./perf/benchmark_config.yaml", "r") as file:
-    base_config = yaml.safe_load(file)
-
+# GPU backends share the device, they are run alone to not disturb each other.
+GPU_BACKENDS = {"gpunufft", "cufinufft", "tensorflow", "torchkbnufft-gpu"}
 
-combinations = list(itertools.product(backend_names, trajectories, n_coils_list))
 benchmark_script = "10_benchmark_perf.py"
-os.makedirs("temp_configs", exist_ok=True)
+temp_config_path = "temp_configs"
+
 
-# For each combination, create a temporary configuration file and execute the script
-for backend_name, trajectory, n_coils in combinations:
-    config = base_config.copy()
+def get_parser():
+    """
+    Create and return an argument parser for the script.
+
+    """
+    parser = argparse.ArgumentParser(description="Run a sweep of perf benchmarks.")
+    parser.add_argument(
+        "--slots",
+        type=int,
+        default=1,
+        help="Number of benchmarks running at the same time, on disjoint CPUs.",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default="sweep_manifest.sqlite",
+        help="Manifest of the sweep, used to resume an interrupted sweep.",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=2,
+        help="Number of attempts of a failed benchmark.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="outputs/sweep",
+        help="Root of the output directories, one per configuration hash.",
+    )
+    parser.add_argument(
+        "--fork",
+        action="store_true",
+        help="Run the benchmarks in forked children, after loading the inputs once.",
+    )
+    return parser
+
+
+def make_config(base_config, backend_name, trajectory, n_coils, coil_chunk=None):
+    """Create the configuration of one benchmark."""
+    config = copy.deepcopy(base_config)
     config["backend"]["name"] = backend_name
     config["trajectory"] = trajectory
     config["data"]["n_coils"] = n_coils
+    config["data"]["coil_chunk"] = coil_chunk
+    return config
 
-    temp_config_path = "temp_configs"
-    temp_config_file = f"config_{backend_name}_{trajectory.split('/')[-1].split('.')[0]}_{n_coils}.yaml"
 
-    complete_file = os.path.join(temp_config_path, temp_config_file)
-    with open(complete_file, "w") as file:
-        yaml.dump(config, file)
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = get_parser().parse_args()
 
-    subprocess.run(
-        [
-            "python",
-            benchmark_script,
-            "--config-name",
-            temp_config_file,
-            "--config-path",
-            temp_config_path,
-        ]
-    )
+    # Read the base configuration file to copy from
+    with open("./perf/benchmark_config.yaml", "r") as file:
+        base_config = yaml.safe_load(file)
 
-# Clean up temporary configuration files
-for file in os.listdir("temp_configs"):
-    complete_file = os.path.join("temp_configs", file)
-    os.remove(complete_file)
-os.removedirs("temp_configs")
+    # One configuration per combination, run through a resumable sweep
+    configs = {}
+    for backend_name, trajectory, n_coils, coil_chunk in itertools.product(
+        backend_names, trajectories, n_coils_list, coil_chunks
+    ):
+        name = f"{backend_name}_{trajectory.split('/')[-1].split('.')[0]}_{n_coils}_{coil_chunk}"
+        configs[name] = make_config(
+            base_config, backend_name, trajectory, n_coils, coil_chunk
+        )
+    if args.fork:
+        from perf_utils import load_inputs, run_benchmark
+
+        def to_cfg(config):
+            # Parsed like the files of the subprocess runs (1e-3 is a float),
+            # the hydra sections are only used by the hydra script.
+            return OmegaConf.create(
+                yaml.dump(
+                    {k: v for k, v in config.items() if k not in ("defaults", "hydra")}
+                )
+            )
+
+        def fill_caches():
+            for config in configs.values():
+                load_inputs(to_cfg(config))
+            return {}
+
+        # Converting or generating the inputs imports mrinufft, and with it the
+        # frameworks of all the backends: it is done in a child, so that each
+        # benchmark imports its backend after the fork (see block_frameworks).
+        values = run_forked(fill_caches)
+        if "error" in values:
+            logger.error(f"Filling the caches of the inputs failed: {values['error']}")
+        # Shared by all the forked benchmarks (memory-mapped caches).
+        shared = {}
+        for config in configs.values():
+            load_inputs(to_cfg(config), shared)
+        if "mrinufft" in sys.modules:
+            logger.warning("mrinufft was imported before the fork.")
+
+        run_forked_sweep(
+            configs,
+            lambda config: run_benchmark(to_cfg(config), shared),
+            manifest_path=args.manifest,
+            output_dir=args.output_dir,
+            max_attempts=args.max_attempts,
+        )
+    else:
+        run_sweep(
+            configs,
+            benchmark_script,
+            manifest_path=args.manifest,
+            output_dir=args.output_dir,
+            n_slots=args.slots,
+            max_attempts=args.max_attempts,
+            exclusive=lambda config: config["backend"]["name"] in GPU_BACKENDS,
+            temp_config_path=temp_config_path,
+        )
@@ -0,0 +1,149 @@
+"""
+This script runs the quality benchmark of several backend configurations in a
+single process, to compare the backends without preparing their inputs again.
+
+Usage:
+    python auto_benchmark_quality.py [--fork] [--output-dir DIR] [overrides ...]
+
+The inputs which do not depend on the backend (trajectory, reference image, smaps,
+reference k-space, density weights, wavelet transform and regularizer) are loaded
+or computed once, with the `qual/ismrm2024.yaml` configuration and the given Hydra
+overrides (e.g. `trajectory.density=pipe data.n_coils=8`). Then each combination of
+backend, eps and upsampfac is run in sequence, or with `--fork` in a forked child
+process: the shared inputs are not copied (copy-on-write), and the state of a
+backend (CUDA context, plans, memory pools) does not leak into the next one.
+
+Only the backend-specific times are reported for each combination: the operator
+setup, the power method and the time per iteration. The results of each
+combination are written in `<output-dir>/<backend signature>`, readable by
+`42_time_to_quality.py` and `43_coil_quality.py`, and the summary in
+`<output-dir>/sweep_summary.csv`.
+"""
+
+import argparse
+import copy
+import itertools
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from hydra import compose, initialize
+from omegaconf import OmegaConf
+
+from quality_utils import backend_signature, load_shared_inputs, run_reconstruction
+from sweep_utils import run_forked
+
+logger = logging.getLogger(__name__)
+
+# Define parameter lists, the backends need their dependencies installed.
+backend_names = [
+    "finufft",
+    "gpunufft",
+    "cufinufft",
+    "tensorflow",
+    "torchkbnufft-cpu",
+    "torchkbnufft-gpu",
+]
+eps_list = [1e-3]
+upsampfacs = [2.0]
+
+SUMMARY_COLUMNS = [
+    "backend",
+    "eps",
+    "upsampfac",
+    "setup_time",
+    "power_method_time",
+    "spec_rad_cached",
+    "iteration_time",
+    "run_time",
+    "end_ssim",
+    "end_snr",
+    "error",
+]
+
+
+def get_parser():
+    """
+    Create and return an argument parser for the script.
+
+    """
+    parser = argparse.ArgumentParser(
+        description="Run the quality benchmark of several backends in one process."
+    )
+    parser.add_argument(
+        "--config-name",
+        type=str,
+        default="ismrm2024",
+        help="Quality configuration, in the qual directory.",
+    )
+    parser.add_argument(
+        "--fork",
+        action="store_true",
+        help="Run each combination in a forked child process.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=f"outputs-qual/sweep_{time.strftime('%Y-%m-%d_%H-%M-%S')}",
+        help="Root of the output directories, one per combination.",
+    )
+    parser.add_argument(
+        "overrides", nargs="*", help="Hydra overrides of the configuration."
+    )
+    return parser
+
+
+def run_combination(cfg, shared, output_dir):
+    """Run one combination, return its results or the error."""
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        return run_reconstruction(cfg, shared, output_dir)
+    except Exception as exc:
+        logger.exception(f"Reconstruction in {output_dir} failed")
+        return {"error": repr(exc)}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = get_parser().parse_args()
+
+    with initialize(version_base=None, config_path="qual"):
+        base_cfg = compose(config_name=args.config_name, overrides=args.overrides)
+
+    tic = time.perf_counter()
+    shared = load_shared_inputs(base_cfg)
+    shared_time = time.perf_counter() - tic
+    logger.info(f"Shared inputs prepared in {shared_time:.2f}s: {shared.timings}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    rows = []
+    for backend_name, eps, upsampfac in itertools.product(
+        backend_names, eps_list, upsampfacs
+    ):
+        cfg = copy.deepcopy(base_cfg)
+        cfg.backend.name = backend_name
+        cfg.backend.eps = eps
+        cfg.backend.upsampfac = upsampfac
+        output_dir = Path(args.output_dir) / backend_signature(cfg, shared.n_coils)
+        if args.fork:
+            results = run_forked(run_combination, cfg, shared, output_dir)
+        else:
+            results = run_combination(cfg, shared, output_dir)
+        rows.append({"backend": backend_name, "eps": eps, "upsampfac": upsampfac})
+        rows[-1] |= {k: v for k, v in results.items() if k in SUMMARY_COLUMNS}
+    sweep_time = time.perf_counter() - tic
+
+    summary = pd.DataFrame(rows).reindex(columns=SUMMARY_COLUMNS)
+    print(summary.to_string(index=False))
+    summary.to_csv(Path(args.output_dir) / "sweep_summary.csv", index=False)
+    with open(Path(args.output_dir) / "sweep_config.yaml", "w") as f:
+        f.write(OmegaConf.to_yaml(base_cfg))
+    logger.info(
+        f"Sweep done in {sweep_time:.2f}s, of which {shared_time:.2f}s to prepare"
+        " the shared inputs."
+    )
+    if summary["error"].notna().any():
+        sys.exit(1)
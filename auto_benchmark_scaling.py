@@ -0,0 +1,112 @@
+"""
+This script runs the scaling suite: the perf benchmark swept over the image size,
+the number of samples and the number of coils, for the fitting of the cost models
+(see `36_scaling_fit.py`).
+
+Usage:
+    python auto_benchmark_scaling.py [--slots N]
+
+The trajectories are not read from files: they are generated on the fly (and cached)
+by the `mrinufft.trajectories` initializer given below, with a number of shots
+`Nc` swept to vary the number of samples. The grid is the full product of the
+lists below, for each backend, and runs as a resumable sweep like
+`auto_benchmark_perf.py`.
+"""
+
+import argparse
+import copy
+import itertools
+import logging
+
+import yaml
+
+from sweep_utils import run_sweep
+
+# Define the scaling grid
+backend_names = [
+    "finufft",
+    # "cufinufft",
+    # "gpunufft",
+]
+trajectory_init = "initialize_3D_floret"
+trajectory_kwargs = {"Ns": 1024, "nb_revolutions": 6}
+shapes = [(64, 64, 64), (96, 96, 96), (128, 128, 128)]
+n_shots_list = [256, 512, 1024]  # Nc, number of samples = Nc * Ns
+n_coils_list = [1, 4, 8]
+
+# GPU backends share the device, they are run alone to not disturb each other.
+GPU_BACKENDS = {"gpunufft", "cufinufft", "tensorflow", "torchkbnufft-gpu"}
+
+benchmark_script = "10_benchmark_perf.py"
+temp_config_path = "temp_configs"
+
+
+def get_parser():
+    """
+    Create and return an argument parser for the script.
+
+    """
+    parser = argparse.ArgumentParser(description="Run the scaling suite.")
+    parser.add_argument(
+        "--slots",
+        type=int,
+        default=1,
+        help="Number of benchmarks running at the same time, on disjoint CPUs.",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default="scaling_manifest.sqlite",
+        help="Manifest of the sweep, used to resume an interrupted sweep.",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=2,
+        help="Number of attempts of a failed benchmark.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="outputs/scaling",
+        help="Root of the output directories, one per configuration hash.",
+    )
+    return parser
+
+
+def make_config(base_config, backend_name, shape, n_shots, n_coils):
+    """Create the configuration of one benchmark of the suite."""
+    config = copy.deepcopy(base_config)
+    config["backend"]["name"] = backend_name
+    config["trajectory"] = {
+        "name": trajectory_init,
+        "shape": list(shape),
+        "kwargs": {"Nc": n_shots, **trajectory_kwargs},
+    }
+    config["data"]["n_coils"] = n_coils
+    return config
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = get_parser().parse_args()
+
+    with open("./perf/benchmark_config.yaml", "r") as file:
+        base_config = yaml.safe_load(file)
+
+    configs = {}
+    for backend_name, shape, n_shots, n_coils in itertools.product(
+        backend_names, shapes, n_shots_list, n_coils_list
+    ):
+        name = f"{backend_name}_{'x'.join(map(str, shape))}_{n_shots}_{n_coils}"
+        configs[name] = make_config(base_config, backend_name, shape, n_shots, n_coils)
+    run_sweep(
+        configs,
+        benchmark_script,
+        manifest_path=args.manifest,
+        output_dir=args.output_dir,
+        n_slots=args.slots,
+        max_attempts=args.max_attempts,
+        exclusive=lambda config: config["backend"]["name"] in GPU_BACKENDS,
+        temp_config_path=temp_config_path,
+    )
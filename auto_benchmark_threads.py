@@ -0,0 +1,112 @@
+"""
+This script runs the thread-scaling benchmarks: the perf benchmark of the CPU
+backends with the thread pools limited to 1..N threads (see the `threads` option),
+for the strong-scaling analysis of `37_thread_scaling.py`.
+
+Usage:
+    python auto_benchmark_threads.py [--max-threads N]
+
+Each run is exclusive (alone on the machine), with the thread-count environment
+variables and the `threads` option set to its thread count. The sweep is resumable
+like `auto_benchmark_perf.py`.
+"""
+
+import argparse
+import copy
+import itertools
+import logging
+import os
+
+import yaml
+
+from sweep_utils import run_sweep, thread_env
+
+# Define parameter lists, CPU backends only
+backend_names = [
+    "finufft",
+    # "torchkbnufft-cpu",
+]
+trajectories = [
+    "./trajs/floret_256x256x176_0.5.bin",
+]
+n_coils_list = [1, 12]
+
+benchmark_script = "10_benchmark_perf.py"
+temp_config_path = "temp_configs"
+
+
+def get_parser():
+    """
+    Create and return an argument parser for the script.
+
+    """
+    parser = argparse.ArgumentParser(description="Run the thread-scaling sweep.")
+    parser.add_argument(
+        "--max-threads",
+        type=int,
+        default=len(os.sched_getaffinity(0)),
+        help="Largest thread count, default to the available CPUs.",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default="threads_manifest.sqlite",
+        help="Manifest of the sweep, used to resume an interrupted sweep.",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=2,
+        help="Number of attempts of a failed benchmark.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="outputs/threads",
+        help="Root of the output directories, one per configuration hash.",
+    )
+    return parser
+
+
+def thread_counts(max_threads):
+    """Return the powers of two up to ``max_threads``, and ``max_threads``."""
+    counts = [2**i for i in range(max_threads.bit_length()) if 2**i <= max_threads]
+    return sorted(set(counts) | {max_threads})
+
+
+def make_config(base_config, backend_name, trajectory, n_coils, n_threads):
+    """Create the configuration of one benchmark."""
+    config = copy.deepcopy(base_config)
+    config["backend"]["name"] = backend_name
+    config["trajectory"] = trajectory
+    config["data"]["n_coils"] = n_coils
+    config["threads"] = n_threads
+    config["monitor"]["gpu"] = False
+    return config
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = get_parser().parse_args()
+
+    with open("./perf/benchmark_config.yaml", "r") as file:
+        base_config = yaml.safe_load(file)
+
+    configs = {}
+    for backend_name, trajectory, n_coils, n_threads in itertools.product(
+        backend_names, trajectories, n_coils_list, thread_counts(args.max_threads)
+    ):
+        name = f"{backend_name}_{trajectory.split('/')[-1].split('.')[0]}_{n_coils}_{n_threads}t"
+        configs[name] = make_config(
+            base_config, backend_name, trajectory, n_coils, n_threads
+        )
+    run_sweep(
+        configs,
+        benchmark_script,
+        manifest_path=args.manifest,
+        output_dir=args.output_dir,
+        max_attempts=args.max_attempts,
+        exclusive=lambda config: True,
+        env=lambda config: thread_env(config["threads"]),
+        temp_config_path=temp_config_path,
+    )
@@ -0,0 +1,214 @@
+"""Content-addressed on-disk cache for the benchmark arrays.
+
+Entries are ``.npy`` files (with an optional JSON sidecar of metadata) named
+after a hash of all the parameters used to generate them. They are written
+atomically (to a temporary file renamed in place), so concurrent sweep jobs
+never read a partial file, and opened with ``mmap_mode="r"`` so that parallel
+jobs share the same page-cache pages.
+The least recently used entries are evicted to stay under a disk budget.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_GiB = 1024.0**3
+
+
+def cache_key(**params) -> str:
+    """Return a stable hash of the generation parameters."""
+    serialized = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()[:16]
+
+
+def array_hash(arr: np.ndarray, chunk_size: int = 2**26) -> str:
+    """Return a hash of the content, shape and dtype of an array.
+
+    The array is hashed chunk by chunk, so memory-mapped arrays are not
+    loaded at once.
+    """
+    arr = np.ascontiguousarray(arr)
+    digest = hashlib.sha256(f"{arr.dtype.str}{arr.shape}".encode())
+    flat = arr.reshape(-1).view(np.uint8)
+    for start in range(0, flat.size, chunk_size):
+        digest.update(flat[start : start + chunk_size])
+    return digest.hexdigest()[:16]
+
+
+def cache_path(cachedir: str | os.PathLike, name: str, params: dict) -> Path:
+    """Return the path of the cache entry for these parameters."""
+    return Path(cachedir) / f"{name}_{cache_key(**params)}.npy"
+
+
+def load_cached(path: os.PathLike) -> np.ndarray | None:
+    """Open a cache entry with ``mmap_mode="r"``, or return None on a miss."""
+    try:
+        arr = np.load(path, mmap_mode="r")
+    except FileNotFoundError:
+        return None
+    _touch(Path(path))
+    return arr
+
+
+def load_sidecar(path: os.PathLike) -> dict:
+    """Return the JSON metadata stored next to a cache entry."""
+    with open(Path(path).with_suffix(".json")) as f:
+        return json.load(f)
+
+
+def save_cached(
+    path: os.PathLike,
+    arr: np.ndarray,
+    sidecar: dict | None = None,
+    max_size_GiB: float | None = None,
+) -> None:
+    """Atomically write a cache entry, with optional JSON metadata."""
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    if sidecar is not None:
+        # Written first, so that an entry never lacks its metadata.
+        _atomic_write(
+            path.with_suffix(".json"),
+            lambda f: f.write(json.dumps(sidecar, default=_json_default).encode()),
+        )
+    _atomic_write(path, lambda f: np.save(f, arr))
+    if max_size_GiB is not None:
+        evict_lru(path.parent, max_size_GiB, keep=(path,))
+
+
+def cached_array(
+    cachedir: str | os.PathLike,
+    name: str,
+    params: dict,
+    shape: tuple[int, ...],
+    dtype: np.dtype,
+    fill: Callable[[np.ndarray], None],
+    max_size_GiB: float | None = None,
+) -> np.ndarray:
+    """Get an array from the cache, generating it on a miss.
+
+    Parameters
+    ----------
+    cachedir
+        Directory of the cache.
+    name
+        Prefix of the cache entry.
+    params
+        All the parameters used to generate the array, they define the key.
+    shape
+        Shape of the array.
+    dtype
+        Datatype of the array.
+    fill
+        Callable filling in place the preallocated (memory-mapped) array.
+    max_size_GiB
+        Disk budget of the cache directory. If None, nothing is evicted.
+
+    Returns
+    -------
+    np.ndarray
+        Read-only memory-mapped array.
+    """
+    cachedir = Path(cachedir)
+    shape = tuple(int(s) for s in shape)
+    path = cache_path(cachedir, name, params)
+    arr = load_cached(path)
+    if arr is not None:
+        return arr
+
+    os.makedirs(cachedir, exist_ok=True)
+    logger.info(f"Cache miss for {path.name}, generating it.")
+    fd, tmp_path = tempfile.mkstemp(dir=cachedir, prefix=f".{name}_", suffix=".tmp")
+    os.close(fd)
+    try:
+        arr = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.dtype(dtype), shape=shape
+        )
+        fill(arr)
+        arr.flush()
+        del arr
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    if max_size_GiB is not None:
+        evict_lru(cachedir, max_size_GiB, keep=(path,))
+    return np.load(path, mmap_mode="r")
+
+
+def evict_lru(
+    cachedir: str | os.PathLike,
+    max_size_GiB: float,
+    keep: tuple[os.PathLike, ...] = (),
+) -> list[Path]:
+    """Remove the least recently used entries until the cache fits the budget.
+
+    Returns
+    -------
+    list[Path]
+        The removed entries.
+    """
+    entries = []
+    for path in Path(cachedir).glob("*.npy"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:  # removed by a concurrent job.
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    keep = {Path(p) for p in keep}
+    removed = []
+    for _, size, path in entries:
+        if total <= max_size_GiB * _GiB:
+            break
+        if path in keep:
+            continue
+        for entry in (path, path.with_suffix(".json")):
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+        total -= size
+        removed.append(path)
+        logger.info(f"Evicted {path.name} from cache.")
+    return removed
+
+
+def _touch(path: Path) -> None:
+    """Mark a cache entry as recently used."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _atomic_write(path: Path, write: Callable) -> None:
+    """Write a file through a temporary file renamed in place."""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.stem}_", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _json_default(obj):
+    """Serialize the numpy values of the metadata."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
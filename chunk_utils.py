@@ -0,0 +1,111 @@
+"""Coil-chunked application of the NUFFT operators.
+
+Instead of expanding the image to all the coils at once (``image * smaps``)
+and applying an operator on ``n_coils`` channels, the coils are processed by
+batches of ``coil_chunk``: each batch of coil images is formed in a reused
+buffer, transformed by an operator sized for the batch, and the result is
+accumulated into preallocated outputs. The peak memory then grows with the
+chunk size instead of the number of coils.
+"""
+
+from typing import Callable
+
+import numpy as np
+
+
+class CoilChunkedOperator:
+    """Apply a multi-coil NUFFT by batches of coils.
+
+    The operator exposes the ``op``, ``adj_op`` and ``data_consistency``
+    methods of the MRI-NUFFT operators. The image given to ``op`` and
+    ``data_consistency`` is the single-coil image, the coil images are formed
+    chunk by chunk with the sensitivity maps.
+
+    Parameters
+    ----------
+    make_operator: callable
+        Create an operator without sensitivity maps for a given number of
+        coils, ``make_operator(n_coils)``.
+    smaps: np.ndarray
+        Sensitivity maps, of shape ``(n_coils, *shape)``.
+    coil_chunk: int
+        Number of coils processed at once.
+    sense: bool, default True
+        If True, the adjoint and gradient are combined with the sensitivity
+        maps into a single image. Otherwise, one image per coil is returned.
+
+    Notes
+    -----
+    The outputs are preallocated and reused: the array returned by a call is
+    overwritten by the next call of the same method.
+    """
+
+    def __init__(
+        self,
+        make_operator: Callable,
+        smaps: np.ndarray,
+        coil_chunk: int,
+        sense: bool = True,
+    ):
+        self.smaps = smaps
+        self.n_coils = smaps.shape[0]
+        self.shape = tuple(smaps.shape[1:])
+        self.coil_chunk = min(int(coil_chunk), self.n_coils)
+        if self.coil_chunk < 1:
+            raise ValueError("coil_chunk must be positive.")
+        self.uses_sense = sense
+        self.chunks = [
+            (start, min(start + self.coil_chunk, self.n_coils))
+            for start in range(0, self.n_coils, self.coil_chunk)
+        ]
+        # One operator per chunk size, the last chunk may be smaller.
+        self.operators = {
+            size: make_operator(size) for size in {c1 - c0 for c0, c1 in self.chunks}
+        }
+        self.n_samples = self.operators[self.coil_chunk].n_samples
+
+        dtype = smaps.dtype
+        self._coil_images = np.empty((self.coil_chunk, *self.shape), dtype=dtype)
+        self._kspace = np.empty((self.n_coils, self.n_samples), dtype=dtype)
+        img_shape = self.shape if sense else (self.n_coils, *self.shape)
+        self._image = np.empty(img_shape, dtype=dtype)
+
+    def op(self, data: np.ndarray) -> np.ndarray:
+        """Forward operator, from the single-coil image to the coils k-space."""
+        for c0, c1, nufft, coil_images in self._iter_chunks():
+            np.multiply(self.smaps[c0:c1], data, out=coil_images)
+            self._kspace[c0:c1] = nufft.op(coil_images).reshape(c1 - c0, -1)
+        return self._kspace
+
+    def adj_op(self, coeffs: np.ndarray) -> np.ndarray:
+        """Adjoint operator, from the coils k-space to the image(s)."""
+        if self.uses_sense:
+            self._image[:] = 0
+        for c0, c1, nufft, coil_images in self._iter_chunks():
+            self._combine(c0, c1, nufft.adj_op(coeffs[c0:c1]), coil_images)
+        return self._image
+
+    def data_consistency(self, data: np.ndarray, obs_data: np.ndarray) -> np.ndarray:
+        """Gradient of the data consistency, ``A^H(A x - y)``."""
+        if self.uses_sense:
+            self._image[:] = 0
+        for c0, c1, nufft, coil_images in self._iter_chunks():
+            np.multiply(self.smaps[c0:c1], data, out=coil_images)
+            grad = nufft.data_consistency(coil_images, obs_data[c0:c1])
+            self._combine(c0, c1, grad, coil_images)
+        return self._image
+
+    def _iter_chunks(self):
+        """Yield the coil range, operator and coil images buffer of each chunk."""
+        for c0, c1 in self.chunks:
+            yield c0, c1, self.operators[c1 - c0], self._coil_images[: c1 - c0]
+
+    def _combine(self, c0, c1, coil_result, coil_images):
+        """Accumulate (sense) or store the coil images of a chunk."""
+        coil_result = coil_result.reshape(c1 - c0, *self.shape)
+        if not self.uses_sense:
+            self._image[c0:c1] = coil_result
+            return
+        np.conjugate(self.smaps[c0:c1], out=coil_images)
+        coil_images *= coil_result
+        self._image += coil_images.sum(axis=0)
@@ -0,0 +1 @@
+"""Make the flat modules of the repository importable by the tests."""
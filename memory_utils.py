@@ -0,0 +1,119 @@
+"""Exact peak memory of the benchmark tasks.
+
+The resource monitor samples the memory every ``interval`` seconds, which
+misses the peak of short tasks. Here the high-water mark of the resident
+memory is read from the kernel instead:
+
+- On Linux, ``VmHWM`` of ``/proc/self/status`` is reset to the current
+  resident memory by writing ``5`` to ``/proc/self/clear_refs``, so the peak
+  of every block of code can be measured in the process itself.
+- Otherwise, the block is run in a forked child process, whose
+  ``ru_maxrss`` starts at the resident memory inherited from the parent.
+
+Optionally, the peak of the Python and NumPy allocations is tracked with
+``tracemalloc`` (this slows down the allocations).
+"""
+
+import re
+import resource
+import sys
+import tracemalloc
+
+from sweep_utils import run_forked
+
+_KiB_TO_GiB = 1 / 1024.0**2
+# ``ru_maxrss`` is in bytes on macOS, in KiB elsewhere.
+_MAXRSS_TO_GiB = 1 / 1024.0**3 if sys.platform == "darwin" else _KiB_TO_GiB
+
+
+def read_status(key: str) -> int:
+    """Return a memory entry of ``/proc/self/status``, in KiB."""
+    with open("/proc/self/status") as f:
+        return int(re.search(rf"^{key}:\s+(\d+)", f.read(), re.MULTILINE).group(1))
+
+
+def reset_peak() -> None:
+    """Reset the high-water mark ``VmHWM`` to the current resident memory."""
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+class PeakMemory:
+    """Measure the peak resident memory of a block of code.
+
+    After the block, ``values`` contains (in GiB):
+
+    - ``mem_hwm``: the peak resident memory.
+    - ``mem_delta``: its increment over the resident memory before the block.
+    - ``mem_py_peak``: the peak of the traced allocations, if ``trace_python``.
+
+    Parameters
+    ----------
+    trace_python: bool, default False
+        Also track the Python and NumPy allocations with tracemalloc.
+
+    Example
+    -------
+    >>> with PeakMemory() as peak:
+    ...     nufft.op(data)
+    >>> peak.values["mem_hwm"]
+    """
+
+    def __init__(self, trace_python: bool = False):
+        self.trace_python = trace_python
+        self.values = {}
+
+    @staticmethod
+    def supported() -> bool:
+        """Check if the high-water mark can be reset in the process."""
+        try:
+            reset_peak()
+            read_status("VmHWM")
+        except (OSError, AttributeError):
+            return False
+        return True
+
+    def __enter__(self):
+        if self.trace_python:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        reset_peak()
+        self._baseline = read_status("VmRSS")
+        return self
+
+    def __exit__(self, *exc_info):
+        peak = read_status("VmHWM")
+        self.values = {
+            "mem_hwm": peak * _KiB_TO_GiB,
+            "mem_delta": (peak - self._baseline) * _KiB_TO_GiB,
+        }
+        if self.trace_python:
+            self.values["mem_py_peak"] = tracemalloc.get_traced_memory()[1] / 1024**3
+
+
+def child_peak_memory(fun, *args) -> dict:
+    """Run ``fun(*args)`` in a forked child and return its peak memory.
+
+    The fallback of ``PeakMemory`` when the high-water mark cannot be reset,
+    forked with ``sweep_utils.run_forked``. The peak is ``ru_maxrss`` of the
+    child at the end of the call, and the increment is relative to its value
+    just after the fork.
+
+    Returns
+    -------
+    dict
+        ``mem_hwm`` and ``mem_delta`` in GiB, or ``error`` if the call failed.
+    """
+    return run_forked(_peak_memory, fun, *args)
+
+
+def _peak_memory(fun, *args) -> dict:
+    """Call ``fun(*args)`` and return the peak ``ru_maxrss`` and its increase."""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    fun(*args)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "mem_hwm": peak * _MAXRSS_TO_GiB,
+        "mem_delta": (peak - baseline) * _MAXRSS_TO_GiB,
+    }
@@ -0,0 +1,506 @@
+"""Perf benchmark of a NUFFT backend, shared by the hydra script and the sweeps.
+
+``run_benchmark`` times the tasks (forward, adjoint, grad) of one
+configuration, see ``10_benchmark_perf.py`` for a single run and
+``auto_benchmark_perf.py --fork`` for a sweep loading its inputs once.
+"""
+
+import logging
+import os
+import sys
+import warnings
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+from hydra_callbacks.logger import PerfLogger
+from hydra_callbacks.monitor import ResourceMonitorService
+from omegaconf import DictConfig, OmegaConf
+
+from chunk_utils import CoilChunkedOperator
+from memory_utils import PeakMemory, child_peak_memory
+from profiling_utils import SamplingProfiler
+from results_utils import ResultsWriter
+from timing_utils import TimingEngine
+from utils import (
+    block_frameworks,
+    generate_trajectory,
+    get_smaps,
+    load_trajectory,
+    process_uptime,
+    random_complex,
+    trajectory_name,
+)
+
+# Check for threadpoolctl availability for the thread pools control
+THREADPOOLCTL_AVAILABLE = True
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    THREADPOOLCTL_AVAILABLE = False
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Suppress specific warnings from mrinufft module
+warnings.filterwarnings(
+    "ignore",
+    "Samples will be rescaled to .*",
+    category=UserWarning,
+    module="mrinufft",
+)
+
+ROOT_DIR = Path(__file__).parent
+
+# Backends with their own thread count option.
+THREADS_KWARGS = {"finufft": "nthreads"}
+
+
+def load_inputs(cfg, shared=None):
+    """Load the trajectory and the sensitivity maps of a configuration.
+
+    With a ``shared`` dict, they are memoized in it, keyed on their
+    configuration: a sweep driver fills it once for all its jobs.
+
+    Returns
+    -------
+    np.ndarray
+        The trajectory.
+    dict
+        The trajectory parameters.
+    np.ndarray or None
+        The sensitivity maps, None for a single coil.
+    """
+    shared = {} if shared is None else shared
+    # Initialize trajectory, from a file or generated on the fly
+    cpx_type = np.dtype(cfg.data.dtype)
+    traj_cfg = cfg.trajectory
+    if OmegaConf.is_config(traj_cfg):
+        traj_cfg = OmegaConf.to_container(traj_cfg)
+    traj_key = ("trajectory", repr(traj_cfg), cpx_type.name)
+    if traj_key not in shared:
+        if isinstance(cfg.trajectory, str):
+            shared[traj_key] = load_trajectory(
+                ROOT_DIR / cfg.trajectory,
+                dtype=np.finfo(cpx_type).dtype,
+                cachedir=os.path.join(cfg.cache.dir, "trajs"),
+                max_cache_size_GiB=cfg.cache.max_size_GiB,
+            )
+        else:
+            shared[traj_key] = generate_trajectory(
+                cfg.trajectory.name,
+                cfg.trajectory.shape,
+                OmegaConf.to_container(cfg.trajectory.get("kwargs", {})),
+                nb_stacks=cfg.trajectory.get("nb_stacks"),
+                dtype=np.finfo(cpx_type).dtype,
+                cachedir=os.path.join(cfg.cache.dir, "trajs"),
+                max_cache_size_GiB=cfg.cache.max_size_GiB,
+            )
+    trajectory, params = shared[traj_key]
+
+    # Initialize sensitivity maps
+    smaps = None
+    if cfg.data.n_coils > 1:
+        XYZ = tuple(params["img_size"])
+        smaps_key = ("smaps", XYZ, cfg.data.n_coils)
+        if smaps_key not in shared:
+            shared[smaps_key] = get_smaps(
+                XYZ,
+                cfg.data.n_coils,
+                cachedir=os.path.join(cfg.cache.dir, "smaps"),
+                max_cache_size_GiB=cfg.cache.max_size_GiB,
+            )
+        smaps = shared[smaps_key]
+    return trajectory, params, smaps
+
+
+def get_data(cfg, shared=None):
+    """Initialize all the data for the benchmark.
+
+    The trajectory and the sensitivity maps come from ``load_inputs``, with
+    the ``shared`` inputs of a sweep if given.
+
+    The random data is generated from ``cfg.data.seed``. If it is null, a seed
+    is drawn, and returned to be recorded with the results.
+
+    With ``cfg.data.coil_chunk``, the image is not expanded to the coils: the
+    single-coil image and the sensitivity maps are returned, the coil images
+    are formed chunk by chunk by the operator.
+    """
+    cpx_type = np.dtype(cfg.data.dtype)
+    trajectory, params, smaps_true = load_inputs(cfg, shared)
+
+    C = cfg.data.n_coils
+    XYZ = tuple(params["img_size"])
+    K = np.prod(trajectory.shape[:-1])
+
+    seed = cfg.data.get("seed")
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+        logger.info(f"Drawn random seed {seed}")
+    rng = np.random.default_rng(seed)
+
+    # Load or generate data
+    if data_file := getattr(cfg.data, "file", None):
+        data = np.load(data_file)
+        if data.shape != XYZ:
+            logger.warning("mismatched shape between data and trajectory file.")
+    else:
+        data = random_complex(XYZ, cpx_type, rng, distribution="uniform")
+
+    # Generate k-space data
+    ksp_data = random_complex((C, K), cpx_type, rng, distribution="normal")
+
+    smaps = None
+    if smaps_true is not None:
+        if cfg.data.smaps or cfg.data.get("coil_chunk"):
+            smaps = smaps_true
+        else:
+            # Expand the data to multicoil
+            data = data[None, ...] * smaps_true
+
+    return (data, ksp_data, trajectory, smaps, XYZ, C, seed)
+
+
+def set_threads(cfg, kwargs):
+    """Limit the thread pools to ``cfg.threads`` and return the thread count.
+
+    The BLAS/OpenMP pools are limited with threadpoolctl, and the backends with
+    their own option get it in the operator ``kwargs``. If ``cfg.threads`` is
+    null, nothing is changed and the CPU count available to the process is
+    returned.
+    """
+    n_threads = cfg.get("threads")
+    if not n_threads:
+        return len(os.sched_getaffinity(0))
+    if THREADPOOLCTL_AVAILABLE:
+        threadpool_limits(limits=n_threads)
+    else:
+        logger.warning("threadpoolctl is not installed, only the backend is limited.")
+    if cfg.backend.name in THREADS_KWARGS:
+        kwargs[THREADS_KWARGS[cfg.backend.name]] = n_threads
+    return n_threads
+
+
+def run_task(nufft, task, data, ksp_data):
+    """Apply one benchmark task with the given operator."""
+    if task == "forward":
+        return nufft.op(data)
+    elif task == "adjoint":
+        return nufft.adj_op(ksp_data)
+    elif task == "grad":
+        return nufft.data_consistency(data, ksp_data)
+    else:
+        raise ValueError(f"Unknown task {task}")
+
+
+def get_monit_values(monit, cfg):
+    """Summarize the resources collected by the monitor during one run."""
+    values = monit.get_values()
+    monit_values = {
+        "mem_avg": np.mean(values["rss_GiB"]),
+        "mem_peak": np.max(values["rss_GiB"]),
+        "cpu_avg": np.mean(values["cpus"]),
+        "cpu_peak": np.max(values["cpus"]),
+    }
+    if cfg.monitor.gpu:
+        gpu_keys = [k for k in values.keys() if "gpu" in k]
+        for k in gpu_keys:
+            monit_values[f"{k}_avg"] = np.mean(values[k])
+            monit_values[f"{k}_peak"] = np.max(values[k])
+    return monit_values
+
+
+def get_schema(monit):
+    """Return the columns of the results file, in a fixed order."""
+    schema = {
+        "backend": "str",
+        "trajectory": "str",
+        "eps": "float",
+        "upsampfac": "float",
+        "n_coils": "int",
+        "shape": "str",
+        "n_samples": "int",
+        "dim": "int",
+        "sense": "bool",
+        "mode": "str",
+        "n_threads": "int",
+        "coil_chunk": "int",
+        "seed": "int",
+        "startup_time": "float",
+        "import_time": "float",
+        "task": "str",
+        "phase": "str",
+        "run": "int",
+        "row_type": "str",
+        "warmup": "bool",
+        "outlier": "bool",
+        "run_time": "float",
+        "mem_avg": "float",
+        "mem_peak": "float",
+        "cpu_avg": "float",
+        "cpu_peak": "float",
+        "mem_hwm": "float",
+        "mem_delta": "float",
+        "mem_py_peak": "float",
+        "profile_overhead": "float",
+    }
+    if monit.gpu_monit:
+        for i in monit.gpu_devices:
+            for k in (f"gpu{i}_mem_GiB", f"gpu{i}_usage"):
+                schema |= {f"{k}_avg": "float", f"{k}_peak": "float"}
+    schema |= {
+        "n_runs": "int",
+        "run_time_q1": "float",
+        "run_time_q3": "float",
+        "run_time_iqr": "float",
+        "run_time_ci_low": "float",
+        "run_time_ci_high": "float",
+    }
+    return schema
+
+
+def get_summary_row(kept_rows, summary):
+    """Summarize the kept (not warm-up) runs of a task.
+
+    The run time statistics come from the timing engine, the resource columns
+    are the medians over the runs which are not outliers.
+    """
+    rows = [row for row in kept_rows if not row["outlier"]] or kept_rows
+    monit_keys = [
+        k for k in rows[0] if k.startswith(("mem_", "cpu_", "gpu", "profile_"))
+    ]
+    return (
+        {
+            "task": rows[0]["task"],
+            "phase": rows[-1]["phase"],
+            "run": len(kept_rows),
+            "row_type": "summary",
+            "warmup": False,
+            "outlier": False,
+            "run_time": summary["median"],
+        }
+        | {k: np.nanmedian([row[k] for row in rows]) for k in monit_keys}
+        | {
+            "n_runs": summary["n_runs"],
+            "run_time_q1": summary["q1"],
+            "run_time_q3": summary["q3"],
+            "run_time_iqr": summary["iqr"],
+            "run_time_ci_low": summary["ci_low"],
+            "run_time_ci_high": summary["ci_high"],
+        }
+    )
+
+
+def run_benchmark(cfg: DictConfig, shared: dict | None = None) -> None:
+    """Run the benchmark, writing the results in the current directory.
+
+    Two modes are available through ``cfg.mode``:
+
+    - ``rebuild``: a new operator is created before every run, and only the
+      application of the operator is timed.
+    - ``reuse``: the operator construction (precomputation, planning, smaps
+      upload) is timed once as the ``setup`` task, then every task is run
+      repeatedly on the same operator. The first call of each task is tagged
+      with the ``first`` phase, the following ones with the ``steady`` phase.
+
+    With ``cfg.data.coil_chunk``, the coils are processed by batches of this
+    size, accumulated into preallocated outputs (see ``CoilChunkedOperator``).
+    With ``cfg.threads``, the thread pools are limited to this size.
+
+    With ``cfg.monitor.exact_memory``, the exact peak resident memory of each
+    run (``mem_hwm``) and its increment over the memory before the run
+    (``mem_delta``) are recorded, see ``PeakMemory``. If the high-water mark
+    cannot be reset, one more run of each task is done in a child process,
+    and its peak is recorded in the summary row.
+
+    mrinufft (and cupy) are imported in the run, after blocking the frameworks
+    of the other backends (unless ``cfg.block_frameworks`` is false). The time
+    from the start of the process to the run (interpreter, imports, hydra) is
+    recorded in ``startup_time``, and the import of mrinufft and of the
+    backend in ``import_time``.
+
+    With ``cfg.profile.enabled``, the runs of each task are profiled by a
+    sampling profiler, written in ``profile_<backend>_<task>.collapsed`` and
+    ``.speedscope.json``. The CPU time of the sampler during each run is
+    recorded in ``profile_overhead``, to discount the profiled run times.
+
+    With ``shared`` inputs (see ``load_inputs``), a sweep driver running the
+    benchmarks in forked children loads them once. The ``startup_time`` is
+    then the time since the fork.
+
+    The number of runs of each task is decided by the timing engine configured
+    in ``cfg.timing``. Every raw run is saved (warm-up runs and outliers are
+    flagged), followed by a ``summary`` row with the median, IQR and confidence
+    interval of the run time.
+    """
+    # TODO Add a DSL like bart::extra_args:value::extra_arg2:value2 etc
+
+    startup_time = process_uptime()
+    # Import mrinufft with the frameworks of the selected backend only
+    if cfg.get("block_frameworks", True):
+        blocked = block_frameworks(cfg.backend.name)
+        logger.debug(f"Blocked modules: {blocked}")
+    with PerfLogger(logger, name=f"{cfg.backend.name}_import") as perflog:
+        from mrinufft import get_operator
+
+        # Initialize the NUFFT operator
+        nufftKlass = get_operator(cfg.backend.name)
+    import_time = perflog.get_timer(f"{cfg.backend.name}_import")
+    data, ksp_data, trajectory, smaps, shape, n_coils, seed = get_data(cfg, shared)
+    logger.debug(
+        f"{data.shape}, {ksp_data.shape}, {trajectory.shape}, {n_coils}, {shape}"
+    )
+    mode = cfg.get("mode", "rebuild")
+    if mode not in ("rebuild", "reuse"):
+        raise ValueError(f"Unknown mode {mode}")
+
+    # Set up resource monitoring
+    monit = ResourceMonitorService(
+        interval=cfg.monitor.interval, gpu_monit=cfg.monitor.gpu
+    )
+    kwargs = {}
+    if "stacked" in cfg.backend.name:
+        kwargs["z_index"] = "auto"
+    n_threads = set_threads(cfg, kwargs)
+
+    def make_nufft(n_coils, smaps):
+        return nufftKlass(
+            trajectory,
+            shape,
+            n_coils=n_coils,
+            smaps=smaps,
+            eps=cfg.backend.eps,
+            upsampfac=cfg.backend.upsampfac,
+            **kwargs,
+        )
+
+    coil_chunk = cfg.data.get("coil_chunk")
+    if coil_chunk and n_coils > 1:
+
+        def make_operator():
+            return CoilChunkedOperator(
+                lambda chunk: make_nufft(chunk, None),
+                smaps,
+                coil_chunk,
+                sense=cfg.data.smaps,
+            )
+
+    else:
+        coil_chunk = None
+
+        def make_operator():
+            return make_nufft(n_coils, smaps)
+
+    exact_memory = cfg.monitor.get("exact_memory", False)
+    peak_memory = None
+    if exact_memory and PeakMemory.supported():
+        peak_memory = PeakMemory(trace_python=cfg.monitor.get("tracemalloc", False))
+    elif exact_memory:
+        logger.info("VmHWM cannot be reset, the peak memory is measured in a child.")
+
+    with (
+        monit,
+        PerfLogger(logger, name=f"{cfg.backend.name}_setup") as perflog,
+        peak_memory or nullcontext(),
+    ):
+        nufft = make_operator()
+    setup_values = {
+        "task": "setup",
+        "phase": "setup",
+        "run": 0,
+        "row_type": "run",
+        "warmup": False,
+        "outlier": False,
+        "run_time": perflog.get_timer(f"{cfg.backend.name}_setup"),
+    } | get_monit_values(monit, cfg)
+    if peak_memory is not None:
+        setup_values |= peak_memory.values
+
+    run_config = {
+        "backend": cfg.backend.name,
+        "trajectory": trajectory_name(cfg.trajectory),
+        "eps": cfg.backend.eps,
+        "upsampfac": cfg.backend.upsampfac,
+        "n_coils": nufft.n_coils,
+        "shape": nufft.shape,
+        "n_samples": nufft.n_samples,
+        "dim": len(nufft.shape),
+        "sense": nufft.uses_sense,
+        "mode": mode,
+        "n_threads": n_threads,
+        "coil_chunk": nufft.coil_chunk if coil_chunk else nufft.n_coils,
+        "seed": seed,
+        "startup_time": startup_time,
+        "import_time": import_time,
+    }
+    result_file = f"{cfg.backend.name}_{cfg.backend.upsampfac}_{run_config['trajectory']}_{cfg.backend.eps}_{cfg.data.n_coils}"
+    if coil_chunk:
+        result_file += f"_chunk{nufft.coil_chunk}"
+    writer = ResultsWriter(
+        result_file,
+        get_schema(monit),
+        metadata=OmegaConf.to_container(cfg, resolve=True),
+        file_format=cfg.results.format,
+        flush_every=cfg.results.flush_every,
+    )
+    if mode == "reuse":
+        writer.write(run_config | setup_values)
+
+    # Run benchmark tasks
+    warmup = cfg.timing.warmup
+    if mode == "reuse":
+        # The first call is never part of the steady-state statistics.
+        warmup = max(warmup, 1)
+    engine = TimingEngine.from_config(cfg.timing, warmup=warmup)
+    for task in cfg.task:
+        rows = []
+        profiler = SamplingProfiler.from_config(cfg.get("profile"))
+        for i, is_warmup in engine.runs():
+            if mode == "rebuild":
+                nufft = make_operator()
+            with (
+                monit,
+                profiler or nullcontext(),
+                PerfLogger(logger, name=f"{cfg.backend.name}_{task}, #{i}") as perflog,
+                peak_memory or nullcontext(),
+            ):
+                run_task(nufft, task, data, ksp_data)
+            run_time = perflog.get_timer(f"{cfg.backend.name}_{task}, #{i}")
+            engine.record(run_time)
+            rows.append(
+                {
+                    "task": task,
+                    "phase": "steady" if mode == "reuse" and i > 0 else "first",
+                    "run": i,
+                    "row_type": "run",
+                    "warmup": is_warmup,
+                    "outlier": False,
+                    "run_time": run_time,
+                }
+                | get_monit_values(monit, cfg)
+                | (peak_memory.values if peak_memory is not None else {})
+                | ({"profile_overhead": profiler.last_overhead} if profiler else {})
+            )
+        kept_rows = [row for row in rows if not row["warmup"]]
+        for row, outlier in zip(kept_rows, engine.outliers()):
+            row["outlier"] = outlier
+        rows.append(get_summary_row(kept_rows, engine.summary()))
+        if profiler is not None:
+            profiler.write(f"profile_{cfg.backend.name}_{task}")
+            logger.info(f"Profile of {task}: {profiler.summary()}")
+        if exact_memory and peak_memory is None:
+            values = child_peak_memory(run_task, nufft, task, data, ksp_data)
+            if "error" in values:
+                logger.warning(f"Peak memory of {task} failed: {values.pop('error')}")
+            rows[-1] |= values
+
+        # Save benchmark results
+        for row in rows:
+            writer.write(run_config | row)
+    writer.close()
+    del nufft
+    # Only if the backend imported cupy
+    cp = sys.modules.get("cupy")
+    if cp is not None:
+        cp.get_default_memory_pool().free_all_blocks()
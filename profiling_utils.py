@@ -0,0 +1,145 @@
+"""Low-overhead statistical profiling of the benchmark tasks.
+
+A sampler thread records the Python stack of the profiled thread at a fixed
+interval. Native calls (the NUFFT libraries) appear as the Python frame
+calling them, so the time spent in the Python glue, the sensitivity maps or
+the density weighting can be told apart from the native NUFFT.
+
+The samples are exported as collapsed stacks (``a;b;c count``, for
+flamegraph.pl or speedscope) and as a speedscope JSON file. The CPU time of
+the sampler thread is recorded, as an estimate of the profiler overhead.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Sample the stack of the thread entering the context.
+
+    The same profiler can be entered several times (one per run of a task),
+    the samples are accumulated.
+
+    Parameters
+    ----------
+    interval: float, default 0.001
+        Sampling interval in seconds.
+
+    Attributes
+    ----------
+    samples: Counter
+        Number of samples of each stack, from the root frame.
+    duration: float
+        Total profiled wall time in seconds.
+    overhead: float
+        Total CPU time of the sampler thread in seconds.
+    last_overhead: float
+        CPU time of the sampler thread during the last profiled block.
+    """
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.samples = Counter()
+        self.duration = 0.0
+        self.overhead = 0.0
+        self.last_overhead = 0.0
+
+    @classmethod
+    def from_config(cls, cfg):
+        """Create the profiler of the ``profile`` section, or None if disabled."""
+        if not cfg or not cfg.get("enabled", False):
+            return None
+        return cls(interval=cfg.get("interval", 0.001))
+
+    def __enter__(self):
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), daemon=True
+        )
+        self._tic = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.duration += time.perf_counter() - self._tic
+        self.overhead += self.last_overhead
+
+    def _sample(self, thread_id):
+        tic = time.thread_time()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            self.samples[tuple(reversed(stack))] += 1
+        self.last_overhead = time.thread_time() - tic
+
+    @property
+    def n_samples(self) -> int:
+        """Total number of samples."""
+        return sum(self.samples.values())
+
+    def summary(self) -> dict[str, float]:
+        """Return the number of samples and the overhead of the profiler."""
+        return {
+            "n_samples": self.n_samples,
+            "duration": self.duration,
+            "overhead": self.overhead,
+            "overhead_ratio": self.overhead / self.duration if self.duration else 0.0,
+        }
+
+    def write(self, path) -> None:
+        """Write ``<path>.collapsed`` and ``<path>.speedscope.json``."""
+        self.write_collapsed(f"{path}.collapsed")
+        self.write_speedscope(f"{path}.speedscope.json", name=os.path.basename(path))
+
+    def write_collapsed(self, path) -> None:
+        """Write the samples as collapsed stacks, one ``a;b;c count`` per line."""
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(";".join(_frame_name(fr) for fr in stack) + f" {count}\n")
+
+    def write_speedscope(self, path, name="profile") -> None:
+        """Write the samples as a speedscope sampled profile."""
+        frames = {}
+        samples, weights = [], []
+        for stack, count in self.samples.items():
+            samples.append([frames.setdefault(fr, len(frames)) for fr in stack])
+            weights.append(count * self.interval)
+        profile = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {
+                "frames": [
+                    {"name": fr[0], "file": fr[1], "line": fr[2]} for fr in frames
+                ]
+            },
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+            "name": name,
+            "exporter": "mri-nufft-benchmark",
+        }
+        with open(path, "w") as f:
+            json.dump(profile, f)
+
+
+def _frame_name(frame) -> str:
+    """Return the label of a frame in the collapsed stacks."""
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
@@ -0,0 +1,416 @@
+"""Steps of the quality benchmark, shared by the single runs and the sweeps.
+
+The inputs which do not depend on the backend (trajectory, reference image,
+sensitivity maps, reference k-space, density weights, wavelet transform and
+regularizer) are prepared once by ``load_shared_inputs``. ``run_reconstruction``
+then builds the operator of one backend configuration and runs the solver.
+``20_benchmark_quality.py`` runs one reconstruction, ``auto_benchmark_quality.py``
+all the backend configurations of a sweep in the same process.
+"""
+
+import copy
+import csv
+import json
+import logging
+import os
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+from hydra_callbacks.logger import PerfLogger
+from hydra_callbacks.monitor import ResourceMonitorService
+from modopt.math.metrics import snr, ssim
+from modopt.opt.linear import Identity
+from omegaconf import OmegaConf
+
+from mrinufft import get_operator
+from mri.operators.proximity import AutoWeightedSparseThreshold
+
+from cache_utils import array_hash
+from memory_utils import PeakMemory
+from profiling_utils import SamplingProfiler
+from solver_utils import (
+    ConvergenceTracker,
+    get_grad_op,
+    OPTIMIZERS,
+    initialize_opt,
+    load_spec_rad,
+    reconstruction_cost,
+    save_spec_rad,
+    WaveletTransform,
+)
+from utils import compute_density, get_smaps, load_trajectory, reference_kspace
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = Path(__file__).parent
+
+
+@dataclass
+class SharedInputs:
+    """Inputs of the reconstructions which do not depend on the backend.
+
+    Attributes
+    ----------
+    traj: np.ndarray
+        The trajectory.
+    traj_hash: str
+        Hash of the content of the trajectory, in the cache keys.
+    shape: tuple[int, ...]
+        Shape of the image.
+    traj_base: str
+        Name of the trajectory, in the result files.
+    ref_data: np.ndarray
+        The reference image.
+    n_coils: int
+        Number of coils, SENSE reconstruction if > 1.
+    smaps: np.ndarray or None
+        Sensitivity maps of the coils.
+    smaps_hash: str or None
+        Hash of the content of the sensitivity maps, in the cache keys.
+    ksp_data: np.ndarray
+        Simulated k-space of the reference image.
+    density: np.ndarray or bool
+        Density weights, or True/False to let the operator handle them.
+    density_info: dict
+        Cost of the density estimation.
+    linear_op: WaveletTransform
+        Sparsifying transform.
+    regularizer_op: AutoWeightedSparseThreshold
+        Regularizer, copied for each reconstruction (its weights are updated).
+    cache_dir: Path
+        Root of the caches.
+    timings: dict[str, float]
+        Time of each preparation step, in seconds.
+    """
+
+    traj: np.ndarray
+    traj_hash: str
+    shape: tuple
+    traj_base: str
+    ref_data: np.ndarray
+    n_coils: int
+    smaps: np.ndarray | None
+    smaps_hash: str | None
+    ksp_data: np.ndarray
+    density: np.ndarray | bool
+    density_info: dict
+    linear_op: WaveletTransform
+    regularizer_op: AutoWeightedSparseThreshold
+    cache_dir: Path
+    timings: dict[str, float] = field(default_factory=dict)
+
+
+def load_shared_inputs(cfg) -> SharedInputs:
+    """Load or compute the inputs shared by all the backends of a configuration.
+
+    Only the ``trajectory``, ``ref_data``, ``data``, ``solver.wavelet`` and
+    ``cache_dir`` sections of the configuration are used.
+    """
+    timings = {}
+    tic = time.perf_counter()
+    # Read and preprocess trajectory data
+    traj, params = load_trajectory(
+        ROOT_DIR / cfg.trajectory.file,
+        dtype=np.float32,
+        cachedir=ROOT_DIR / cfg.cache_dir / "trajs",
+    )
+    shape = tuple(params["img_size"])
+    ref_data = np.load(ROOT_DIR / cfg.ref_data)
+
+    # Check for shape consistency
+    if ref_data.shape != shape:
+        raise ValueError("shape mismatch between reference data and trajectory.")
+    timings["load"] = time.perf_counter() - tic
+
+    cache_dir = ROOT_DIR / cfg.cache_dir
+    # Multi-coil (SENSE) mode: the coil data is simulated from the reference
+    # image with sensitivity maps, which are used again in the operator.
+    tic = time.perf_counter()
+    n_coils = cfg.get("data", {}).get("n_coils", 1)
+    smaps = None
+    if n_coils > 1:
+        smaps = get_smaps(
+            shape,
+            n_coils,
+            antenna=cfg.data.get("antenna", "birdcage"),
+            cachedir=cache_dir / "smaps",
+        )
+    # Simulate the k-space data with a high precision nufft, cached on the
+    # content of the trajectory, the reference image and the smaps.
+    ksp_data = reference_kspace(
+        traj,
+        ref_data,
+        n_coils=n_coils,
+        smaps=smaps,
+        cachedir=cache_dir / "ksp",
+    )
+    timings["kspace"] = time.perf_counter() - tic
+
+    # Estimate the density weights with a mrinufft.density method (cached),
+    # or let the operator handle it (True/False).
+    tic = time.perf_counter()
+    density_info = {}
+    if isinstance(cfg.trajectory.density, str):
+        density, density_info = compute_density(
+            traj,
+            shape,
+            cfg.trajectory.density,
+            cachedir=cache_dir / "density",
+            **cfg.trajectory.get("density_kwargs", {}),
+        )
+        logger.info(f"Density estimation: {density_info}")
+    else:
+        density = cfg.trajectory.density
+    timings["density"] = time.perf_counter() - tic
+
+    # Setup linear operator and regularizer
+    tic = time.perf_counter()
+    linear_op = WaveletTransform(
+        wavelet_name=cfg.solver.wavelet.base,
+        shape=shape,
+        level=cfg.solver.wavelet.nb_scale,
+        n_coils=1,
+        mode="periodization",
+    )
+
+    regularizer_op = AutoWeightedSparseThreshold(
+        linear_op.coeffs_shape,
+        linear=Identity(),
+        update_period=0,  # the weight is updated only once.
+        sigma_range="global",
+        thresh_range="global",
+        threshold_estimation="sure",
+        thresh_type="soft",
+    )
+    timings["wavelet"] = time.perf_counter() - tic
+
+    return SharedInputs(
+        traj=traj,
+        traj_hash=array_hash(traj),
+        shape=shape,
+        traj_base=Path(cfg.trajectory.file).stem,
+        ref_data=ref_data,
+        n_coils=n_coils,
+        smaps=smaps,
+        smaps_hash=None if smaps is None else array_hash(smaps),
+        ksp_data=ksp_data,
+        density=density,
+        density_info=density_info,
+        linear_op=linear_op,
+        regularizer_op=regularizer_op,
+        cache_dir=cache_dir,
+        timings=timings,
+    )
+
+
+def backend_signature(cfg, n_coils: int = 1) -> str:
+    """Return the name of a backend configuration, in the result files."""
+    backend_sig = f"{cfg.backend.name}_{cfg.backend.eps:.0e}_{cfg.backend.upsampfac}"
+    if n_coils > 1:
+        backend_sig += f"_{n_coils}c"
+    return backend_sig
+
+
+def run_reconstruction(cfg, shared: SharedInputs, output_dir=".") -> dict:
+    """Build the operator of a backend configuration and run the solver.
+
+    The reconstructed image, the convergence records, the profile and the
+    results are written in ``output_dir``.
+
+    Parameters
+    ----------
+    cfg: DictConfig
+        Configuration of the quality benchmark.
+    shared: SharedInputs
+        The inputs prepared by ``load_shared_inputs`` with the same configuration.
+    output_dir: str or Path, default "."
+        Directory of the output files.
+
+    Returns
+    -------
+    dict
+        The results, also written in ``results_<backend signature>.json``.
+    """
+    output_dir = Path(output_dir)
+    shape, traj_base = shared.shape, shared.traj_base
+    linear_op = shared.linear_op
+    regularizer_op = copy.deepcopy(shared.regularizer_op)
+    backend_sig = backend_signature(cfg, shared.n_coils)
+
+    # Initialize the Fourier Operator to benchmark (SENSE if n_coils > 1)
+    with PerfLogger(logger, name=f"{backend_sig}_setup") as perflog:
+        fourier_op = get_operator(cfg.backend.name)(
+            shared.traj,
+            shape,
+            n_coils=shared.n_coils,
+            smaps=shared.smaps,
+            density=shared.density,
+            eps=cfg.backend.eps,
+            upsampfac=cfg.backend.upsampfac,
+            squeeze_dims=True,
+        )
+    setup_time = perflog.get_timer(f"{backend_sig}_setup")
+
+    # Setup gradient operator and solver. The spectral radius (power method,
+    # a forward and adjoint NUFFT per iteration) is cached, and timed apart.
+    spec_rad_params = {
+        "backend": cfg.backend.name,
+        "trajectory": shared.traj_hash,
+        "density": array_hash(shared.density)
+        if isinstance(shared.density, np.ndarray)
+        else shared.density,
+        "shape": list(shape),
+        "eps": cfg.backend.eps,
+        "upsampfac": cfg.backend.upsampfac,
+        "n_coils": shared.n_coils,
+        "smaps": shared.smaps_hash,
+        "formulation": OPTIMIZERS[cfg.solver.optimizer],
+        "wavelet": cfg.solver.wavelet.base,
+        "nb_scale": cfg.solver.wavelet.nb_scale,
+    }
+    spec_rad_dir = shared.cache_dir / "specrad"
+    spec_rad, spec_rad_info = load_spec_rad(spec_rad_dir, spec_rad_params)
+    with PerfLogger(logger, name=f"{backend_sig}_power_method") as perflog:
+        grad_op = get_grad_op(
+            fourier_op,
+            OPTIMIZERS[cfg.solver.optimizer],
+            linear_op,
+            reuse_buffers=True,
+            lipschitz_cst=spec_rad,
+            # The constant was checked when it was computed.
+            num_check_lips=0 if spec_rad is not None else 10,
+        )
+    power_method_time = perflog.get_timer(f"{backend_sig}_power_method")
+    if spec_rad is None:
+        save_spec_rad(
+            spec_rad_dir, spec_rad_params, grad_op.spec_rad, power_method_time
+        )
+    grad_op._obs_data = shared.ksp_data
+
+    # Track the convergence every k iterations, on a region of the image
+    tracker = None
+    conv_cfg = cfg.get("convergence")
+    if conv_cfg and conv_cfg.enabled:
+        synthesis = OPTIMIZERS[cfg.solver.optimizer] == "synthesis"
+        cost = reconstruction_cost(grad_op, linear_op, regularizer_op, synthesis)
+        tracker = ConvergenceTracker(
+            shared.ref_data,
+            period=conv_cfg.period,
+            max_iter=cfg.solver.max_iter,
+            region=conv_cfg.region,
+            slab_width=conv_cfg.slab_width,
+            subsample=conv_cfg.subsample,
+            # The wavelet synthesis of the iterate is timed in the overhead.
+            to_image=linear_op.adj_op if synthesis else None,
+            cost=cost if conv_cfg.cost else None,
+        )
+
+    solver = initialize_opt(
+        cfg.solver.optimizer,
+        grad_op,
+        linear_op,
+        regularizer_op,
+        opt_kwargs={"cost": None, "progress": True},
+        metric_kwargs=tracker.metric_kwargs() if tracker is not None else None,
+    )
+    logger.info(f"Grad inv spec rad {grad_op.inv_spec_rad}")
+
+    # Start Reconstruction process, optionally profiling the iterations
+    profiler = SamplingProfiler.from_config(cfg.get("profile"))
+    peak_memory = PeakMemory() if PeakMemory.supported() else nullcontext()
+    with (
+        ResourceMonitorService(
+            interval=cfg.monitor.interval, gpu_monit=cfg.monitor.gpu
+        ) as monit,
+        PerfLogger(logger, name=backend_sig) as perflog,
+    ):
+        with profiler or nullcontext(), peak_memory:
+            if tracker is not None:
+                tracker.start()
+            tic = time.perf_counter()
+            solver.iterate(max_iter=cfg.solver.max_iter)
+            iterate_time = time.perf_counter() - tic
+        if OPTIMIZERS[cfg.solver.optimizer] == "synthesis":
+            x_final = linear_op.adj_op(solver.x_final)
+        else:
+            x_final = solver.x_final
+        image_rec = np.abs(x_final)
+
+        # Calculate SSIM and SNR (quality metrics)
+        recon_ssim = ssim(image_rec, shared.ref_data)
+        recon_snr = snr(image_rec, shared.ref_data)
+
+    # Save the reconstructed image
+    image_file = f"recon_{backend_sig}_{traj_base}.npy"
+    np.save(output_dir / image_file, image_rec)
+    logger.info(f"{backend_sig}")
+    logger.info(f"SSIM, SNR: {recon_ssim}, {recon_snr}")
+    results = {
+        "backend": cfg.backend.name,
+        "trajectory": traj_base,
+        "eps": cfg.backend.eps,
+        "upsampfac": cfg.backend.upsampfac,
+        "n_coils": shared.n_coils,
+        "density": str(cfg.trajectory.density),
+        "end_snr": recon_snr,
+        "end_ssim": recon_ssim,
+        "image_rec": image_file,
+    }
+    monit_values = monit.get_values()
+
+    # Collect resource monitoring data
+    results["mem_peak"] = np.max(monit_values["rss_GiB"])
+    results["run_time"] = perflog.get_timer(backend_sig)
+    # Time of one iteration, without the convergence tracking
+    if tracker is not None:
+        iterate_time -= tracker.overhead
+    results["iteration_time"] = iterate_time / cfg.solver.max_iter
+    if isinstance(peak_memory, PeakMemory):
+        results.update(peak_memory.values)
+    if cfg.monitor.gpu:
+        gpu_keys = [k for k in monit_values.keys() if "gpu" in k]
+        for k in gpu_keys:
+            results[f"{k}_avg"] = np.mean(monit_values[k])
+            results[f"{k}_peak"] = np.max(monit_values[k])
+
+    # Setup of the operator, and cost of the power method (or of its first
+    # run when it was cached)
+    results["setup_time"] = setup_time
+    results["spec_rad"] = float(grad_op.spec_rad)
+    results["spec_rad_cached"] = spec_rad is not None
+    results["power_method_time"] = power_method_time
+    if spec_rad is not None:
+        results["power_method_uncached_time"] = spec_rad_info["run_time"]
+
+    # Convergence records and time to reach the quality targets
+    if tracker is not None:
+        convergence_file = f"convergence_{backend_sig}_{traj_base}.csv"
+        with open(output_dir / convergence_file, "w") as f:
+            writer = csv.DictWriter(f, fieldnames=tracker.records[0].keys())
+            writer.writeheader()
+            writer.writerows(tracker.records)
+        results["convergence"] = {
+            "file": convergence_file,
+            "overhead": tracker.overhead,
+            "time_to_target": tracker.time_to_target(
+                OmegaConf.to_container(conv_cfg.targets)
+            ),
+        }
+
+    # Cost of the density estimation (measured when it was not cached)
+    for k, v in shared.density_info.items():
+        if k != "method":
+            results[f"density_{k}"] = v
+    if profiler is not None:
+        profile_file = output_dir / f"profile_{backend_sig}_{traj_base}_iterate"
+        profiler.write(os.fspath(profile_file))
+        results["profile"] = profiler.summary()
+        logger.info(f"Profile of the iterations: {results['profile']}")
+
+    # Save the results to a JSON file
+    with open(output_dir / f"results_{backend_sig}.json", "w") as f:
+        json.dump(results, f)
+    return results
@@ -0,0 +1,127 @@
+"""Detection of performance regressions against a stored baseline.
+
+The timed runs of new results are matched to the runs of a baseline by their
+configuration (``KEYS``). For each configuration and metric, the two samples
+of runs are compared with a Mann-Whitney U test (no normality assumption),
+and the change of the median is classified: a regression (or improvement) is
+both significant and larger than the threshold of the metric.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.stats import mannwhitneyu
+
+# Configuration of a benchmark, matched between the baseline and the new runs.
+KEYS = ["backend", "trajectory", "task", "n_coils", "eps", "upsampfac"]
+
+# Metrics compared (lower is better), by column of the runs.
+METRICS = ["run_time", "memory"]
+
+# Columns to load from the results files.
+COLUMNS = KEYS + [
+    "mode",
+    "phase",
+    "row_type",
+    "warmup",
+    "run_time",
+    "mem_peak",
+    "mem_hwm",
+]
+
+
+def timed_runs(df: pd.DataFrame) -> pd.DataFrame:
+    """Keep the raw timed runs of results, with their ``memory`` column.
+
+    The summary rows and the warm-up runs are dropped, and with the ``reuse``
+    mode only the steady-state runs are kept. The memory is the exact peak
+    (``mem_hwm``) when it was measured, the sampled one otherwise.
+    """
+    missing = set(KEYS) - set(df.columns)
+    if missing:
+        raise ValueError(f"Results without the columns {sorted(missing)}")
+    df = df[(df["row_type"] == "run") & ~df["warmup"].astype(bool)]
+    if "mode" in df.columns:
+        df = df[(df["mode"] != "reuse") | (df["phase"] != "first")]
+    df = df.copy()
+    df["memory"] = df["mem_peak"]
+    if "mem_hwm" in df.columns:
+        df["memory"] = df["mem_hwm"].fillna(df["mem_peak"])
+    return df[KEYS + METRICS]
+
+
+def compare_runs(
+    baseline: pd.DataFrame,
+    current: pd.DataFrame,
+    thresholds: dict[str, float],
+    alpha: float = 0.05,
+    min_runs: int = 3,
+) -> pd.DataFrame:
+    """Compare the runs of each configuration with the baseline.
+
+    Parameters
+    ----------
+    baseline: pd.DataFrame
+        Runs of the baseline, from ``timed_runs``.
+    current: pd.DataFrame
+        New runs, from ``timed_runs``.
+    thresholds: dict[str, float]
+        Smallest relative change of the median of each metric to report.
+    alpha: float, default 0.05
+        Significance level of the two-sided Mann-Whitney U test.
+    min_runs: int, default 3
+        Minimum number of runs on each side for a test.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per configuration and metric, with the medians, the relative
+        change, the p-value and the ``status``: ``regression``,
+        ``improvement``, ``unchanged``, ``insufficient`` (too few runs) or
+        ``missing`` (configuration absent from the baseline or the new runs).
+    """
+    base_groups = dict(list(baseline.groupby(KEYS)))
+    new_groups = dict(list(current.groupby(KEYS)))
+    rows = []
+    for keys in sorted(base_groups.keys() | new_groups.keys(), key=str):
+        for metric in METRICS:
+            base = _values(base_groups.get(keys), metric)
+            new = _values(new_groups.get(keys), metric)
+            row = dict(zip(KEYS, keys)) | {
+                "metric": metric,
+                "n_base": len(base),
+                "n_new": len(new),
+                "median_base": np.median(base) if len(base) else np.nan,
+                "median_new": np.median(new) if len(new) else np.nan,
+                "rel_change": np.nan,
+                "p_value": np.nan,
+            }
+            if not len(base) or not len(new):
+                row["status"] = "missing"
+            else:
+                row["rel_change"] = row["median_new"] / row["median_base"] - 1
+                if min(len(base), len(new)) < min_runs:
+                    row["status"] = "insufficient"
+                else:
+                    row["p_value"] = mannwhitneyu(
+                        new, base, alternative="two-sided"
+                    ).pvalue
+                    row["status"] = _status(
+                        row["rel_change"], row["p_value"], thresholds[metric], alpha
+                    )
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _values(group, metric) -> np.ndarray:
+    """Return the non-missing values of a metric in a group of runs."""
+    if group is None:
+        return np.array([])
+    values = group[metric].to_numpy(dtype=float)
+    return values[~np.isnan(values)]
+
+
+def _status(rel_change, p_value, threshold, alpha) -> str:
+    """Classify a change of the median of a metric (lower is better)."""
+    if p_value >= alpha or abs(rel_change) < threshold:
+        return "unchanged"
+    return "regression" if rel_change > 0 else "improvement"
@@ -0,0 +1,189 @@
+"""Buffered, typed writer and reader of the benchmark results.
+
+Rows are validated against a fixed schema, buffered in memory and flushed in
+batches to a columnar file: Parquet if pyarrow is available, otherwise a typed
+``.npy`` record file with a JSON sidecar. The resolved configuration of the
+run is stored as metadata.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Check for pyarrow availability for Parquet support
+PYARROW_AVAILABLE = True
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Column type -> (numpy record dtype, fill value of missing entries)
+COLUMN_TYPES = {
+    "str": ("U64", ""),
+    "int": ("i8", -1),
+    "float": ("f8", np.nan),
+    "bool": ("?", False),
+}
+
+
+class ResultsWriter:
+    """Write rows of results with a fixed schema, in batches.
+
+    Parameters
+    ----------
+    path: str
+        Path of the results file, without extension.
+    schema: dict[str, str]
+        Ordered column names and types ("str", "int", "float" or "bool").
+    metadata: dict, default None
+        JSON-serializable metadata, like the resolved configuration.
+    file_format: str, default "auto"
+        "parquet", "npy" or "auto" (parquet if pyarrow is available).
+    flush_every: int, default 64
+        Number of buffered rows triggering a flush.
+    """
+
+    def __init__(
+        self, path, schema, metadata=None, file_format="auto", flush_every=64
+    ):
+        if file_format == "auto":
+            file_format = "parquet" if PYARROW_AVAILABLE else "npy"
+        if file_format == "parquet" and not PYARROW_AVAILABLE:
+            raise ImportError("pyarrow is required to write Parquet files.")
+        if file_format not in ("parquet", "npy"):
+            raise ValueError(f"Unknown results format {file_format}")
+        unknown = set(schema.values()) - COLUMN_TYPES.keys()
+        if unknown:
+            raise ValueError(f"Unknown column types {unknown}")
+        self.schema = dict(schema)
+        self.metadata = metadata or {}
+        self.file_format = file_format
+        self.flush_every = flush_every
+        self.path = Path(f"{path}.{file_format}")
+        self._buffer = {name: [] for name in self.schema}
+        self._n_buffered = 0
+        self._records = []  # npy: all the flushed batches.
+        self._parquet_writer = None
+
+    def write(self, row: dict) -> None:
+        """Buffer a row, missing columns are filled with a typed null value."""
+        unknown = row.keys() - self.schema.keys()
+        if unknown:
+            raise ValueError(f"Columns {sorted(unknown)} are not in the schema.")
+        for name, column_type in self.schema.items():
+            value = row.get(name)
+            if value is None:
+                value = COLUMN_TYPES[column_type][1]
+            elif column_type == "str":
+                value = str(value)
+            self._buffer[name].append(value)
+        self._n_buffered += 1
+        if self._n_buffered >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered rows to the file."""
+        if not self._n_buffered:
+            return
+        if self.file_format == "parquet":
+            self._flush_parquet()
+        else:
+            self._flush_npy()
+        self._buffer = {name: [] for name in self.schema}
+        self._n_buffered = 0
+
+    def close(self) -> None:
+        """Flush the remaining rows and close the file."""
+        self.flush()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _flush_parquet(self):
+        if self._parquet_writer is None:
+            pa_types = {
+                "str": pa.string(),
+                "int": pa.int64(),
+                "float": pa.float64(),
+                "bool": pa.bool_(),
+            }
+            schema = pa.schema(
+                [(name, pa_types[t]) for name, t in self.schema.items()],
+                metadata={"config": json.dumps(self.metadata, default=str)},
+            )
+            self._parquet_writer = pq.ParquetWriter(self.path, schema)
+        table = pa.Table.from_pydict(self._buffer, schema=self._parquet_writer.schema)
+        self._parquet_writer.write_table(table)
+
+    def _flush_npy(self):
+        dtype = [(name, COLUMN_TYPES[t][0]) for name, t in self.schema.items()]
+        records = np.empty(self._n_buffered, dtype=dtype)
+        for name, values in self._buffer.items():
+            records[name] = values
+        self._records.append(records)
+        # The whole file is rewritten atomically, it stays a valid .npy file.
+        tmp_path = self.path.with_suffix(".npy.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.concatenate(self._records))
+        os.replace(tmp_path, self.path)
+        with open(self.path.with_suffix(".json"), "w") as f:
+            json.dump(
+                {"schema": self.schema, "config": self.metadata}, f, default=str
+            )
+
+
+def read_results(path, columns=None) -> pd.DataFrame:
+    """Read a results file (Parquet, npy or legacy CSV).
+
+    Parameters
+    ----------
+    path: str
+        Path of the results file.
+    columns: list[str], default None
+        Columns to load. Columns missing from the file are skipped.
+    """
+    path = Path(path)
+    if path.suffix == ".parquet":
+        if not PYARROW_AVAILABLE:
+            raise ImportError("pyarrow is required to read Parquet files.")
+        names = pq.read_schema(path).names
+        if columns is not None:
+            names = [c for c in columns if c in names]
+        return pd.read_parquet(path, columns=names)
+    elif path.suffix == ".npy":
+        records = np.load(path, mmap_mode="r")
+        names = records.dtype.names
+        if columns is not None:
+            names = [c for c in columns if c in names]
+        return pd.DataFrame({name: records[name] for name in names})
+    elif path.suffix == ".csv":
+        if columns is None:
+            return pd.read_csv(path)
+        return pd.read_csv(path, usecols=lambda c: c in columns)
+    raise ValueError(f"Unknown results format {path.suffix}")
+
+
+def load_results(paths, columns=None) -> pd.DataFrame:
+    """Load and concatenate many results files, with column projection."""
+    return pd.concat(
+        [read_results(path, columns) for path in paths], ignore_index=True
+    )
+
+
+def read_metadata(path) -> dict:
+    """Return the configuration stored with a results file."""
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return json.loads(pq.read_schema(path).metadata[b"config"])
+    with open(path.with_suffix(".json")) as f:
+        return json.load(f)["config"]
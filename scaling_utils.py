@@ -0,0 +1,121 @@
+"""Cost models of the NUFFT operators, fitted on the scaling benchmarks.
+
+The run time of an operator is modeled per coil as ``a*K + b*N*log(N) + c``,
+where ``K`` is the number of samples and ``N`` the number of points of the
+oversampled grid (spreading/interpolation + FFT + fixed cost). The peak
+memory is modeled as ``a*C*K + b*C*N + c``, with ``C`` the number of coils
+(k-space and oversampled grid per coil + fixed footprint). The coefficients
+are fitted by non-negative least squares, for each backend and task.
+"""
+
+import ast
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import nnls
+
+# Model name -> (target column, feature names)
+MODELS = {
+    "time": ("run_time", ("K", "NlogN", "1")),
+    "memory": ("mem_peak", ("CK", "CN", "1")),
+}
+# Columns of the fits which are not the group keys or the model name.
+_FIT_COLUMNS = sorted(
+    {name for _, names in MODELS.values() for name in names}
+    | {"r2", "rel_err", "n_points"}
+)
+
+
+def grid_size(shape, upsampfac: float) -> float:
+    """Return the number of points of the oversampled grid."""
+    if isinstance(shape, str):
+        shape = ast.literal_eval(shape)
+    return float(np.prod(shape)) * upsampfac ** len(shape)
+
+
+def cost_features(n_samples, n_grid, n_coils, model: str) -> np.ndarray:
+    """Return the features of the cost model, one row per benchmark.
+
+    The time features are multiplied by the number of coils (per-coil model).
+    """
+    K = np.asarray(n_samples, dtype=float)
+    N = np.asarray(n_grid, dtype=float)
+    C = np.asarray(n_coils, dtype=float)
+    if model == "time":
+        return C[:, None] * np.stack([K, N * np.log(N), np.ones_like(K)], axis=1)
+    if model == "memory":
+        return np.stack([C * K, C * N, np.ones_like(K)], axis=1)
+    raise ValueError(f"Unknown model {model}")
+
+
+def fit_cost_model(df: pd.DataFrame, model: str) -> dict:
+    """Fit a cost model on benchmark results.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Results with the ``n_samples``, ``shape``, ``upsampfac``, ``n_coils``
+        columns and the target column of the model.
+    model: str
+        "time" or "memory".
+
+    Returns
+    -------
+    dict
+        The coefficients (by feature name), the coefficient of determination
+        ``r2`` and the median relative error ``rel_err`` of the fit.
+    """
+    target, names = MODELS[model]
+    n_grid = [grid_size(s, u) for s, u in zip(df["shape"], df["upsampfac"])]
+    X = cost_features(df["n_samples"], n_grid, df["n_coils"], model)
+    y = df[target].to_numpy(dtype=float)
+    # Scale the features for the conditioning of the solver.
+    scale = np.abs(X).max(axis=0)
+    scale[scale == 0] = 1
+    coefs, _ = nnls(X / scale, y)
+    coefs /= scale
+    pred = X @ coefs
+    ss_tot = np.sum((y - y.mean()) ** 2)
+    r2 = 1 - np.sum((y - pred) ** 2) / ss_tot if ss_tot > 0 else np.nan
+    return dict(zip(names, coefs)) | {
+        "r2": r2,
+        "rel_err": np.median(np.abs(pred - y) / y),
+        "n_points": len(y),
+    }
+
+
+def fit_scaling(df: pd.DataFrame, by=("backend", "task")) -> pd.DataFrame:
+    """Fit the time and memory models for each backend and task.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per group and model, with the coefficients and fit quality.
+    """
+    rows = []
+    for keys, group in df.groupby(list(by)):
+        for model in MODELS:
+            rows.append(
+                dict(zip(by, keys)) | {"model": model} | fit_cost_model(group, model)
+            )
+    return pd.DataFrame(rows)
+
+
+def predict(fits: pd.DataFrame, shape, n_samples, n_coils, upsampfac=2.0):
+    """Predict the run time and peak memory of an untested protocol.
+
+    Returns
+    -------
+    pd.DataFrame
+        The prediction of each model, for each backend and task of the fits.
+    """
+    n_grid = grid_size(shape, upsampfac)
+    rows = []
+    for _, fit in fits.iterrows():
+        _, names = MODELS[fit["model"]]
+        X = cost_features([n_samples], [n_grid], [n_coils], fit["model"])
+        value = float(X[0] @ fit[list(names)].to_numpy(dtype=float))
+        rows.append(
+            fit.drop(_FIT_COLUMNS, errors="ignore").to_dict() | {"prediction": value}
+        )
+    return pd.DataFrame(rows)
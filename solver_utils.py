@@ -1,8 +1,14 @@
+import time
+
 import numpy as np
+from modopt.math.metrics import snr, ssim
 from modopt.opt.algorithms import POGM, ForwardBackward, Condat
 from modopt.opt.linear import Identity
+from mri.operators.gradient.base import GradBaseMRI
 from mri.operators.gradient.gradient import GradAnalysis, GradSynthesis
 
+from cache_utils import cache_path, load_cached, load_sidecar, save_cached
+
 OPTIMIZERS = {
     "pogm": "synthesis",
     "fista": "analysis",
@@ -11,17 +17,90 @@ OPTIMIZERS = {
 }
 
 
-def get_grad_op(fourier_op, grad_formulation, linear_op=None, verbose=False, **kwargs):
-    """Create gradient operator specific to the problem."""
+def get_grad_op(
+    fourier_op,
+    grad_formulation,
+    linear_op=None,
+    verbose=False,
+    reuse_buffers=False,
+    **kwargs,
+):
+    """Create gradient operator specific to the problem.
+
+    If ``reuse_buffers`` is set, the synthesis gradient writes the wavelet
+    coefficients in the same preallocated buffer at each iteration.
+    """
+    if grad_formulation == "analysis" and fourier_op.uses_sense:
+        # pysap-mri only detects SENSE on its own operators, the image of the
+        # power method must not have a coil axis.
+        grad_op = GradBaseMRI(
+            fourier_op.op,
+            fourier_op.adj_op,
+            fourier_op.shape,
+            verbose=verbose,
+            **kwargs,
+        )
+        grad_op.fourier_op = fourier_op
+        return grad_op
     if grad_formulation == "analysis":
         return GradAnalysis(fourier_op=fourier_op, verbose=verbose, **kwargs)
     if grad_formulation == "synthesis":
-        return GradSynthesis(
+        grad_op = GradSynthesis(
             linear_op=linear_op,
             fourier_op=fourier_op,
             verbose=verbose,
             **kwargs,
         )
+        if reuse_buffers:
+            _reuse_buffers(grad_op)
+        return grad_op
+
+
+def _reuse_buffers(grad_op):
+    """Make a synthesis gradient write in a preallocated coefficients buffer.
+
+    The linear operator must support the ``out`` argument (like
+    ``WaveletTransform``). The gradient returned at each iteration overwrites
+    the previous one: a solver keeping it must copy it (see ``initialize_opt``).
+    """
+    fourier_op, linear_op = grad_op.fourier_op, grad_op.linear_op
+    coeffs = np.empty(linear_op.coeffs_buffer_shape, dtype="complex64")
+
+    grad_op.trans_op = lambda data: linear_op.op(fourier_op.adj_op(data), out=coeffs)
+
+
+def load_spec_rad(cachedir, params):
+    """Return the cached spectral radius of a gradient, or None on a miss.
+
+    Parameters
+    ----------
+    cachedir: str
+        Directory of the cache.
+    params: dict
+        Everything defining the gradient operator (backend, trajectory hash,
+        density, shape, eps...), the key of the cache.
+
+    Returns
+    -------
+    float or None
+        The spectral radius, to pass as ``lipschitz_cst`` to the gradient.
+    dict
+        The metadata stored with it, like the ``run_time`` of the power method.
+    """
+    path = cache_path(cachedir, "specrad", params)
+    spec_rad = load_cached(path)
+    if spec_rad is None:
+        return None, {}
+    return float(spec_rad), load_sidecar(path)
+
+
+def save_spec_rad(cachedir, params, spec_rad, run_time):
+    """Cache the spectral radius of a gradient, with the power method run time."""
+    save_cached(
+        cache_path(cachedir, "specrad", params),
+        np.array(spec_rad),
+        sidecar=params | {"run_time": run_time},
+    )
 
 
 def initialize_opt(
@@ -59,12 +138,10 @@ def initialize_opt(
 
     """
     if x_init is None:
-        x_init = np.squeeze(
-            np.zeros(
-                (grad_op.fourier_op.n_coils, *grad_op.fourier_op.shape),
-                dtype="complex64",
-            )
-        )
+        fourier_op = grad_op.fourier_op
+        # With SENSE, the coil images are combined: the image has no coil axis.
+        n_coils = 1 if fourier_op.uses_sense else fourier_op.n_coils
+        x_init = np.squeeze(np.zeros((n_coils, *fourier_op.shape), dtype="complex64"))
 
     if not synthesis_init and hasattr(grad_op, "linear_op"):
         alpha_init = grad_op.linear_op.op(x_init)
@@ -75,7 +152,8 @@ def initialize_opt(
     opt_kwargs = opt_kwargs or dict()
     metric_kwargs = metric_kwargs or dict()
 
-    beta = grad_op.inv_spec_rad
+    # ModOpt requires a float, the power method returns a float32 scalar.
+    beta = float(grad_op.inv_spec_rad)
     if opt_name == "pogm":
         opt = POGM(
             u=alpha_init,
@@ -84,19 +162,28 @@ def initialize_opt(
             z=alpha_init,
             grad=grad_op,
             prox=prox_op,
-            linear=linear_op,
+            # ModOpt only maps the iterate for the metrics, which would run a
+            # wavelet synthesis at every iteration: the metrics get the
+            # coefficients (see ``ConvergenceTracker.to_image``).
+            linear=Identity(),
             beta_param=beta,
             sigma_bar=opt_kwargs.pop("sigma_bar", 0.96),
             auto_iterate=opt_kwargs.pop("auto_iterate", False),
             **opt_kwargs,
             **metric_kwargs,
         )
+        # POGM keeps its first gradient as the previous one, it must not be the
+        # buffer overwritten by the next gradient (see ``_reuse_buffers``).
+        if np.shares_memory(opt._g_old, grad_op.grad):
+            opt._g_old = opt._g_old.copy()
     elif opt_name == "fista":
+        # The iterate is the image: the linear operator of ForwardBackward only
+        # maps it for the metrics, the wavelet adjoint must not be applied.
         opt = ForwardBackward(
             x=x_init,
             grad=grad_op,
             prox=prox_op,
-            linear=linear_op,
+            linear=Identity(),
             beta_param=beta,
             lambda_param=opt_kwargs.pop("lambda_param", 1.0),
             auto_iterate=opt_kwargs.pop("auto_iterate", False),
@@ -122,6 +209,160 @@ def initialize_opt(
     return opt
 
 
+def reconstruction_cost(grad_op, linear_op, prox_op, synthesis):
+    """Return the cost of the reconstruction problem, as a function of the image.
+
+    The data consistency of a synthesis gradient and the regularizer take the
+    wavelet coefficients of the image (the transform is orthogonal).
+    """
+
+    def cost(image):
+        coeffs = linear_op.op(image)
+        return grad_op.cost(coeffs if synthesis else image) + prox_op.cost(coeffs)
+
+    return cost
+
+
+class ConvergenceTracker:
+    """Record the elapsed time, cost and quality of a solver every k iterations.
+
+    The tracker is a ModOpt metric, called after each iteration with the
+    current iterate (see ``metric_kwargs``). The wavelet coefficients of the
+    synthesis solvers are mapped to the image by ``to_image``, only at the
+    recorded iterations. The time spent mapping and computing the metrics is
+    excluded from the recorded elapsed time, and accumulated in ``overhead``.
+
+    Parameters
+    ----------
+    ref_data: np.ndarray
+        Reference image.
+    period: int, default 5
+        Number of iterations between two records.
+    max_iter: int, default None
+        If given, the last iteration is always recorded.
+    region: str, default "full"
+        Region of the image where the SNR and SSIM are computed: "full",
+        "slab" (``slab_width`` central slices along the first axis) or
+        "subsample" (one voxel every ``subsample`` along each axis).
+    slab_width: int, default 8
+        Number of slices of the "slab" region.
+    subsample: int, default 4
+        Subsampling step of the "subsample" region.
+    to_image: callable, default None
+        Map the iterate given by the solver to the image, like the wavelet
+        synthesis of POGM, if it is not.
+    cost: callable, default None
+        Cost function of the image, not recorded if None (see
+        ``reconstruction_cost``).
+
+    Attributes
+    ----------
+    records: list[dict]
+        The ``iteration``, ``time``, ``cost``, ``snr`` and ``ssim`` records.
+    overhead: float
+        Time spent computing the metrics, in seconds.
+    """
+
+    def __init__(
+        self,
+        ref_data,
+        period=5,
+        max_iter=None,
+        region="full",
+        slab_width=8,
+        subsample=4,
+        to_image=None,
+        cost=None,
+    ):
+        self.period = period
+        self.max_iter = max_iter
+        self.to_image = to_image
+        self.cost = cost
+        if region == "full":
+            self.region = ...
+        elif region == "slab":
+            center = ref_data.shape[0] // 2
+            start = max(center - slab_width // 2, 0)
+            self.region = slice(start, start + slab_width)
+        elif region == "subsample":
+            self.region = tuple(slice(None, None, subsample) for _ in ref_data.shape)
+        else:
+            raise ValueError(f"Unknown region {region}")
+        self.ref_data = np.abs(ref_data[self.region])
+        self.start()
+
+    def metric_kwargs(self):
+        """Return the ModOpt metric arguments calling the tracker every iteration."""
+        return {
+            "metrics": {
+                "convergence": {
+                    "metric": self,
+                    "mapping": {"x_new": "test"},
+                    "cst_kwargs": {},
+                    "early_stopping": False,
+                }
+            },
+            # The tracker decides itself when to record.
+            "metric_call_period": 1,
+        }
+
+    def start(self):
+        """Reset the records and start the clock, just before iterating."""
+        self.records = []
+        self.overhead = 0.0
+        self._iteration = 0
+        self._tic = time.perf_counter()
+
+    def __call__(self, test):
+        """Count the iteration and record the metrics if it is time."""
+        now = time.perf_counter()
+        self._iteration += 1
+        last = self.max_iter is not None and self._iteration == self.max_iter
+        if self._iteration % self.period and not last:
+            return 0.0
+        image = self.to_image(test) if self.to_image is not None else test
+        region = np.abs(image[self.region])
+        record = {
+            "iteration": self._iteration,
+            "time": now - self._tic - self.overhead,
+            "cost": float(self.cost(image)) if self.cost is not None else np.nan,
+            "snr": snr(region, self.ref_data),
+            "ssim": ssim(region, self.ref_data),
+        }
+        self.records.append(record)
+        self.overhead += time.perf_counter() - now
+        return record["ssim"]
+
+    def time_to_target(self, targets):
+        """Return the first elapsed time reaching each quality target.
+
+        Parameters
+        ----------
+        targets: dict[str, list[float]]
+            Thresholds of each metric, like ``{"ssim": [0.8, 0.9]}``.
+
+        Returns
+        -------
+        list[dict]
+            The ``metric``, ``target``, ``time`` and ``iteration`` of each
+            target, NaN if it is never reached.
+        """
+        rows = []
+        for metric, thresholds in targets.items():
+            for target in thresholds:
+                reached = [r for r in self.records if r[metric] >= target]
+                first = reached[0] if reached else {"time": np.nan, "iteration": -1}
+                rows.append(
+                    {
+                        "metric": metric,
+                        "target": target,
+                        "time": first["time"],
+                        "iteration": first["iteration"],
+                    }
+                )
+        return rows
+
+
 from modopt.opt.linear import LinearParent
 import pywt
 from joblib import Parallel, delayed, cpu_count
@@ -149,6 +390,9 @@ class WaveletTransform(LinearParent):
         the number of cores to use for multichannel.
     backend: str, default "threading"
         the backend to use for parallel multichannel linear operation.
+    batched: bool, default True
+        If True, all the coils are transformed in a single vectorized call
+        over the spatial axes, instead of one joblib task per coil.
     verbose: int, default 0
         the verbosity level.
 
@@ -164,6 +408,10 @@ class WaveletTransform(LinearParent):
         Backend use for parallel computation
     verbose: int
         Verbosity level
+    coeffs_shape: list[tuple[int,...]]
+        shape of each wavelet band, in the order of the raveled coefficients.
+    n_coeffs: int
+        number of wavelet coefficients per coil.
     """
 
     def __init__(
@@ -176,6 +424,8 @@ class WaveletTransform(LinearParent):
         decimated=True,
         backend="threading",
         mode="symmetric",
+        batched=True,
+        verbose=0,
     ):
         if wavelet_name not in pywt.wavelist(kind="all"):
             raise ValueError(
@@ -196,27 +446,32 @@ class WaveletTransform(LinearParent):
         ca, *cds = pywt.wavedecn_shapes(
             self.shape, wavelet=self.wavelet, mode=self.mode, level=self.level
         )
-        self.coeffs_shape = [ca] + [s for cd in cds for s in cd.values()]
-
-        if len(shape) > 1:
-            self.dwt = pywt.wavedecn
-            self.idwt = pywt.waverecn
-            self._pywt_fun = "wavedecn"
+        # Same band order as ``pywt.ravel_coeffs``.
+        self._bands_keys = [sorted(cd) for cd in cds]
+        self.coeffs_shape = [ca] + [cd[k] for cd in cds for k in sorted(cd)]
+        offsets = np.cumsum([0] + [np.prod(s) for s in self.coeffs_shape])
+        self._bands_slices = [
+            slice(start, stop) for start, stop in zip(offsets[:-1], offsets[1:])
+        ]
+        self.n_coeffs = int(offsets[-1])
+        if n_coils > 1:
+            self.coeffs_buffer_shape = (n_coils, self.n_coeffs)
         else:
-            self.dwt = pywt.wavedec
-            self.idwt = pywt.waverec
-            self._pywt_fun = "wavedec"
+            self.coeffs_buffer_shape = (self.n_coeffs,)
+        self._axes = tuple(range(-len(self.shape), 0))
 
         self.n_coils = n_coils
         if self.n_coils == 1 and self.n_jobs != 1:
             print("Making n_jobs = 1 for WaveletN as n_coils = 1")
             self.n_jobs = 1
         self.backend = backend
+        self.batched = batched
+        self.verbose = verbose
         n_proc = self.n_jobs
         if n_proc < 0:
             n_proc = cpu_count() + self.n_jobs + 1
 
-    def op(self, data):
+    def op(self, data, out=None):
         """Define the wavelet operator.
 
         This method returns the input data convolved with the wavelet filter.
@@ -225,28 +480,41 @@ class WaveletTransform(LinearParent):
         ----------
         data: ndarray or Image
             input 2D data array.
+        out: ndarray, default None
+            preallocated array for the coefficients, of shape ``(n_coeffs,)``
+            or ``(n_coils, n_coeffs)``.
 
         Returns
         -------
         coeffs: ndarray
             the wavelet coefficients.
         """
-        if self.n_coils > 1:
-            coeffs, self.coeffs_slices, self.raw_coeffs_shape = zip(
-                *Parallel(
-                    n_jobs=self.n_jobs, backend=self.backend, verbose=self.verbose
-                )(delayed(self._op)(data[i]) for i in np.arange(self.n_coils))
+        if out is None:
+            dtype = data.dtype if np.issubdtype(data.dtype, np.inexact) else float
+            out = np.empty(self.coeffs_buffer_shape, dtype=dtype)
+        if self.n_coils > 1 and not self.batched:
+            Parallel(n_jobs=self.n_jobs, backend=self.backend, verbose=self.verbose)(
+                delayed(self._op)(data[i], out[i]) for i in np.arange(self.n_coils)
             )
-            coeffs = np.asarray(coeffs)
         else:
-            coeffs, self.coeffs_slices, self.raw_coeffs_shape = self._op(data)
-        return coeffs
+            self._op(data, out)
+        return out
 
-    def _op(self, data):
-        """Single coil wavelet transform."""
-        return pywt.ravel_coeffs(
-            self.dwt(data, mode=self.mode, level=self.level, wavelet=self.wavelet)
+    def _op(self, data, out):
+        """Wavelet transform over the last axes, written in ``out``."""
+        coeffs = pywt.wavedecn(
+            data,
+            wavelet=self.wavelet,
+            mode=self.mode,
+            level=self.level,
+            axes=self._axes,
         )
+        bands = [coeffs[0]] + [
+            cd[k] for cd, keys in zip(coeffs[1:], self._bands_keys) for k in keys
+        ]
+        for band, band_slice in zip(bands, self._bands_slices):
+            out[..., band_slice] = band.reshape(*out.shape[:-1], -1)
+        return out
 
     def adj_op(self, coeffs):
         """Define the wavelet adjoint operator.
@@ -263,24 +531,23 @@ class WaveletTransform(LinearParent):
         data: ndarray
             the reconstructed data.
         """
-        if self.n_coils > 1:
+        if self.n_coils > 1 and not self.batched:
             images = Parallel(
                 n_jobs=self.n_jobs, backend=self.backend, verbose=self.verbose
-            )(
-                delayed(self._adj_op)(coeffs[i], self.coeffs_shape[i])
-                for i in np.arange(self.n_coils)
-            )
-            images = np.asarray(images)
-        else:
-            images = self._adj_op(coeffs)
-        return images
+            )(delayed(self._adj_op)(coeffs[i]) for i in np.arange(self.n_coils))
+            return np.asarray(images)
+        return self._adj_op(coeffs)
 
     def _adj_op(self, coeffs):
-        """Single coil inverse wavelet transform."""
-        return self.idwt(
-            pywt.unravel_coeffs(
-                coeffs, self.coeffs_slices, self.raw_coeffs_shape, self._pywt_fun
-            ),
-            wavelet=self.wavelet,
-            mode=self.mode,
+        """Inverse wavelet transform over the last axes."""
+        lead_shape = coeffs.shape[:-1]
+        bands = iter(
+            coeffs[..., band_slice].reshape(*lead_shape, *band_shape)
+            for band_slice, band_shape in zip(self._bands_slices, self.coeffs_shape)
+        )
+        wav_coeffs = [next(bands)] + [
+            {k: next(bands) for k in keys} for keys in self._bands_keys
+        ]
+        return pywt.waverecn(
+            wav_coeffs, wavelet=self.wavelet, mode=self.mode, axes=self._axes
         )
@@ -0,0 +1,492 @@
+"""Concurrent and resumable execution of the benchmark subprocesses of a sweep.
+
+The available CPUs are partitioned into disjoint sets, one per slot. Each job
+runs in a subprocess pinned to the CPU set of its slot, with the thread-count
+environment variables matching its size. Jobs requiring the whole machine
+(thread-scaling runs, GPU runs sharing a device...) are run exclusively.
+
+The state of every run of a sweep is kept in a SQLite manifest, keyed on the
+hash of the resolved configuration, so that an interrupted sweep can be
+resumed without repeating the completed runs.
+
+Jobs sharing large inputs can instead be run in forked children of a single
+process, with ``run_forked`` or a whole sweep with ``run_forked_sweep``.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+import yaml
+
+from cache_utils import cache_key
+
+logger = logging.getLogger(__name__)
+
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+
+@dataclass
+class Job:
+    """A benchmark subprocess to run.
+
+    Parameters
+    ----------
+    name: str
+        Name of the job, for logging.
+    args: list[str]
+        Command line of the subprocess.
+    exclusive: bool, default False
+        If True, the job runs alone, on all the CPUs.
+    env: dict[str, str]
+        Extra environment variables of the subprocess.
+    """
+
+    name: str
+    args: list[str]
+    exclusive: bool = False
+    env: dict[str, str] = field(default_factory=dict)
+
+
+def partition_cpus(cpus, n_slots: int) -> list[tuple[int, ...]]:
+    """Split the CPUs in ``n_slots`` disjoint sets of consecutive CPUs."""
+    cpus = sorted(cpus)
+    if not 1 <= n_slots <= len(cpus):
+        raise ValueError(f"n_slots must be between 1 and {len(cpus)}.")
+    return [tuple(int(c) for c in part) for part in np.array_split(cpus, n_slots)]
+
+
+def thread_env(n_threads: int) -> dict[str, str]:
+    """Return the environment variables limiting the thread pools sizes."""
+    return {var: str(n_threads) for var in THREAD_ENV_VARS}
+
+
+class Scheduler:
+    """Run jobs concurrently, each pinned to a disjoint set of CPUs.
+
+    Jobs are started in submission order. An exclusive job waits for all the
+    running jobs to finish, and no other job starts until it is done.
+
+    Parameters
+    ----------
+    n_slots: int, default 1
+        Number of jobs running at the same time.
+    cpus: list[int], default None
+        CPUs to use, default to the affinity of the current process.
+    poll_interval: float, default 0.5
+        Interval in seconds between checks of the running jobs.
+    """
+
+    def __init__(self, n_slots=1, cpus=None, poll_interval=0.5):
+        if cpus is None:
+            cpus = os.sched_getaffinity(0)
+        self.cpus = tuple(sorted(cpus))
+        self.slots = partition_cpus(self.cpus, n_slots)
+        self.poll_interval = poll_interval
+        self.queue = deque()
+        self.running = {}  # slot index -> (job, process)
+        self.returncodes = {}
+
+    def submit(self, job: Job) -> None:
+        """Add a job to the queue."""
+        self.queue.append(job)
+
+    def run(self, on_start=None, on_done=None) -> dict[str, int]:
+        """Run all the queued jobs.
+
+        Jobs submitted by the callbacks are run as well.
+
+        Parameters
+        ----------
+        on_start: callable, default None
+            Called with the job when a job starts.
+        on_done: callable, default None
+            Called with the job and its return code when a job finishes.
+
+        Returns
+        -------
+        dict[str, int]
+            Return code of each job.
+        """
+        while self.queue or self.running:
+            self._collect(on_done)
+            self._start_jobs(on_start)
+            if self.running:
+                time.sleep(self.poll_interval)
+        return self.returncodes
+
+    def _start_jobs(self, on_start) -> None:
+        while self.queue:
+            job = self.queue[0]
+            exclusive_running = any(j.exclusive for j, _ in self.running.values())
+            if exclusive_running:
+                return
+            if job.exclusive:
+                if self.running:
+                    return
+                self.queue.popleft()
+                if on_start is not None:
+                    on_start(job)
+                # An exclusive job holds all the slots.
+                self.running = dict.fromkeys(
+                    range(len(self.slots)), (job, self._launch(job, self.cpus))
+                )
+                return
+            free = [i for i in range(len(self.slots)) if i not in self.running]
+            if not free:
+                return
+            self.queue.popleft()
+            if on_start is not None:
+                on_start(job)
+            self.running[free[0]] = (job, self._launch(job, self.slots[free[0]]))
+
+    def _launch(self, job, cpus) -> subprocess.Popen:
+        logger.info(f"Starting {job.name} on CPUs {cpus[0]}-{cpus[-1]}")
+        env = os.environ | thread_env(len(cpus)) | job.env
+        return subprocess.Popen(
+            job.args, env=env, preexec_fn=lambda: os.sched_setaffinity(0, cpus)
+        )
+
+    def _collect(self, on_done) -> None:
+        finished = {}
+        for slot, (job, process) in self.running.items():
+            returncode = process.poll()
+            if returncode is not None:
+                finished[slot] = (job, returncode)
+        for slot in finished:
+            del self.running[slot]
+        # An exclusive job is listed in every slot, report it only once.
+        for job, returncode in {id(j): (j, r) for j, r in finished.values()}.values():
+            if returncode:
+                logger.warning(f"{job.name} failed with return code {returncode}")
+            else:
+                logger.info(f"{job.name} done.")
+            self.returncodes[job.name] = returncode
+            if on_done is not None:
+                on_done(job, returncode)
+
+
+def config_hash(config: dict) -> str:
+    """Return the hash of a resolved benchmark configuration."""
+    return cache_key(**config)
+
+
+class RunManifest:
+    """Persistent record of the runs of a sweep, in a SQLite file.
+
+    Each run is identified by the hash of its configuration, and has a status
+    (``pending``, ``running``, ``done`` or ``failed``), a number of attempts,
+    an output directory and timings.
+
+    Parameters
+    ----------
+    path: str
+        Path of the SQLite file, created if it does not exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS runs (
+                    config_hash TEXT PRIMARY KEY,
+                    name TEXT,
+                    status TEXT,
+                    attempts INTEGER,
+                    output_dir TEXT,
+                    started REAL,
+                    finished REAL,
+                    duration REAL,
+                    returncode INTEGER
+                )"""
+            )
+
+    def add(self, key: str, name: str, output_dir: str) -> None:
+        """Register a run, if not already known."""
+        with self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO runs VALUES (?, ?, 'pending', 0, ?, NULL, "
+                "NULL, NULL, NULL)",
+                (key, name, output_dir),
+            )
+
+    def get(self, key: str) -> dict:
+        """Return the record of a run."""
+        cursor = self._db.execute("SELECT * FROM runs WHERE config_hash = ?", (key,))
+        columns = [c[0] for c in cursor.description]
+        return dict(zip(columns, cursor.fetchone()))
+
+    def should_run(self, key: str, max_attempts: int) -> bool:
+        """Check if a run is not completed and can still be attempted.
+
+        Runs left ``running`` by an interrupted sweep are attempted again.
+        """
+        record = self.get(key)
+        return record["status"] != "done" and record["attempts"] < max_attempts
+
+    def start(self, key: str) -> None:
+        """Mark a run as started."""
+        with self._db:
+            self._db.execute(
+                "UPDATE runs SET status = 'running', attempts = attempts + 1, "
+                "started = ? WHERE config_hash = ?",
+                (time.time(), key),
+            )
+
+    def finish(self, key: str, returncode: int) -> None:
+        """Mark a run as done or failed."""
+        now = time.time()
+        with self._db:
+            self._db.execute(
+                "UPDATE runs SET status = ?, finished = ?, duration = ? - started, "
+                "returncode = ? WHERE config_hash = ?",
+                ("failed" if returncode else "done", now, now, returncode, key),
+            )
+
+    def progress(self, keys, n_slots: int = 1) -> dict:
+        """Return the number of runs per status and the estimated time left.
+
+        The estimate uses the mean duration of the completed runs, divided
+        among the slots.
+        """
+        keys = list(keys)
+        records = [self.get(key) for key in keys]
+        counts = {
+            status: sum(r["status"] == status for r in records)
+            for status in ("pending", "running", "done", "failed")
+        }
+        durations = [r["duration"] for r in records if r["status"] == "done"]
+        remaining = len(records) - counts["done"]
+        eta = np.mean(durations) * remaining / n_slots if durations else np.nan
+        return counts | {"total": len(records), "eta": eta}
+
+
+def run_forked(fun, *args) -> dict:
+    """Run ``fun(*args)`` in a forked child and return its result.
+
+    The child shares the memory of the parent (copy-on-write): the inputs are
+    not copied, and nothing ``fun`` changes leaks into the parent. The CUDA
+    context must not be initialized in the parent, the child creates its own.
+
+    Parameters
+    ----------
+    fun: callable
+        Returns a JSON-serializable dict.
+
+    Returns
+    -------
+    dict
+        The result of ``fun``, or ``error`` if the call failed or the child died.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # child
+        try:
+            os.close(read_fd)
+            try:
+                values = fun(*args)
+            except Exception as exc:
+                logger.exception("Forked call failed")
+                values = {"error": repr(exc)}
+            with os.fdopen(write_fd, "w") as f:
+                json.dump(values, f, default=float)
+        finally:
+            # Never return to the code of the parent.
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        output = f.read()
+    _, status = os.waitpid(pid, 0)
+    if not output:
+        code = os.waitstatus_to_exitcode(status)
+        return {"error": f"child exited with code {code}"}
+    return json.loads(output)
+
+
+def format_progress(progress: dict) -> str:
+    """Format the progress of the sweep for logging."""
+    eta = progress["eta"]
+    eta = "unknown" if np.isnan(eta) else time.strftime("%H:%M:%S", time.gmtime(eta))
+    return (
+        f"{progress['done']}/{progress['total']} done, {progress['failed']} failed, "
+        f"{progress['running']} running, ETA {eta}"
+    )
+
+
+def run_sweep(
+    configs: dict[str, dict],
+    benchmark_script: str,
+    manifest_path: str = "sweep_manifest.sqlite",
+    output_dir: str = "outputs/sweep",
+    n_slots: int = 1,
+    max_attempts: int = 2,
+    exclusive=None,
+    env=None,
+    temp_config_path: str = "temp_configs",
+) -> dict[str, int]:
+    """Run a hydra benchmark script on each configuration of a sweep.
+
+    Each configuration is written in a temporary YAML file, and run in
+    ``<output_dir>/<hash>``. The runs completed by a previous sweep (according
+    to the manifest) are skipped, the failed ones are retried.
+
+    Parameters
+    ----------
+    configs: dict[str, dict]
+        Configurations to run, by name.
+    benchmark_script: str
+        The hydra script to run.
+    manifest_path: str, default "sweep_manifest.sqlite"
+        Manifest of the sweep.
+    output_dir: str, default "outputs/sweep"
+        Root of the output directories.
+    n_slots: int, default 1
+        Number of benchmarks running at the same time, on disjoint CPUs.
+    max_attempts: int, default 2
+        Number of attempts of a failed run.
+    exclusive: callable, default None
+        Called with a configuration, True if it must run alone.
+    env: callable, default None
+        Called with a configuration, extra environment variables of its run.
+    temp_config_path: str, default "temp_configs"
+        Directory of the temporary configuration files.
+
+    Returns
+    -------
+    dict[str, int]
+        Return code of each run job.
+    """
+    os.makedirs(temp_config_path, exist_ok=True)
+    manifest = RunManifest(manifest_path)
+    scheduler = Scheduler(n_slots=n_slots)
+    jobs_keys = {}
+    for name, config in configs.items():
+        key = config_hash(config)
+        temp_config_file = f"config_{name}_{key}.yaml"
+        run_dir = os.path.abspath(os.path.join(output_dir, key))
+        manifest.add(key, temp_config_file, run_dir)
+        jobs_keys[temp_config_file] = key
+        if not manifest.should_run(key, max_attempts):
+            logger.info(f"Skipping {temp_config_file}: {manifest.get(key)['status']}")
+            continue
+
+        with open(os.path.join(temp_config_path, temp_config_file), "w") as file:
+            yaml.dump(config, file)
+
+        scheduler.submit(
+            Job(
+                name=temp_config_file,
+                args=[
+                    sys.executable,
+                    benchmark_script,
+                    "--config-name",
+                    temp_config_file,
+                    "--config-path",
+                    temp_config_path,
+                    f"hydra.run.dir={run_dir}",
+                ],
+                exclusive=exclusive is not None and exclusive(config),
+                env={} if env is None else env(config),
+            )
+        )
+
+    def on_start(job):
+        manifest.start(jobs_keys[job.name])
+
+    def on_done(job, returncode):
+        key = jobs_keys[job.name]
+        manifest.finish(key, returncode)
+        if manifest.should_run(key, max_attempts):
+            scheduler.submit(job)  # retry
+        elif not returncode:
+            os.remove(os.path.join(temp_config_path, job.name))
+        progress = manifest.progress(jobs_keys.values(), n_slots=n_slots)
+        logger.info(format_progress(progress))
+
+    returncodes = scheduler.run(on_start=on_start, on_done=on_done)
+
+    # Clean up the temporary configuration files of the completed runs.
+    if not os.listdir(temp_config_path):
+        os.removedirs(temp_config_path)
+    return returncodes
+
+
+def _run_in_dir(run_job, config, run_dir):
+    """Run a job in its output directory, next to its configuration."""
+    os.chdir(run_dir)
+    with open("config.yaml", "w") as file:
+        yaml.dump(config, file)
+    run_job(config)
+    return {}
+
+
+def run_forked_sweep(
+    configs: dict[str, dict],
+    run_job,
+    manifest_path: str = "sweep_manifest.sqlite",
+    output_dir: str = "outputs/sweep",
+    max_attempts: int = 2,
+) -> dict[str, int]:
+    """Run each configuration of a sweep in a forked child of this process.
+
+    Unlike ``run_sweep``, no interpreter is started for the jobs: what the
+    parent loaded before the call is shared with the children (copy-on-write).
+    Each child runs one job in ``<output_dir>/<hash>`` and exits, so that its
+    memory measurements and its state (thread pools, GPU context) stay
+    isolated. The jobs run one at a time, and are recorded in the same
+    manifest as ``run_sweep``.
+
+    Parameters
+    ----------
+    configs: dict[str, dict]
+        Configurations to run, by name.
+    run_job: callable
+        Called in the child with a configuration, in its output directory.
+    manifest_path: str, default "sweep_manifest.sqlite"
+        Manifest of the sweep.
+    output_dir: str, default "outputs/sweep"
+        Root of the output directories.
+    max_attempts: int, default 2
+        Number of attempts of a failed run.
+
+    Returns
+    -------
+    dict[str, int]
+        Return code of each run job, 1 if it failed.
+    """
+    manifest = RunManifest(manifest_path)
+    keys = {name: config_hash(config) for name, config in configs.items()}
+    for name, key in keys.items():
+        manifest.add(key, name, os.path.abspath(os.path.join(output_dir, key)))
+
+    returncodes = {}
+    for name, config in configs.items():
+        key = keys[name]
+        if not manifest.should_run(key, max_attempts):
+            logger.info(f"Skipping {name}: {manifest.get(key)['status']}")
+            continue
+        while manifest.should_run(key, max_attempts):
+            manifest.start(key)
+            run_dir = manifest.get(key)["output_dir"]
+            os.makedirs(run_dir, exist_ok=True)
+            values = run_forked(_run_in_dir, run_job, config, run_dir)
+            if "error" in values:
+                logger.error(f"{name} failed: {values['error']}")
+            returncodes[name] = int("error" in values)
+            manifest.finish(key, returncodes[name])
+        logger.info(format_progress(manifest.progress(keys.values())))
+    return returncodes
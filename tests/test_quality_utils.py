@@ -0,0 +1,78 @@
+"""Steps of the quality benchmark, on a small 3D problem."""
+
+import json
+
+import numpy as np
+import pytest
+from omegaconf import OmegaConf
+
+# The regularizer of pysap-mri requires pysap.
+pytest.importorskip("mri.operators.proximity")
+
+from modopt.opt.linear import Identity  # noqa: E402
+from modopt.opt.proximity import SparseThreshold  # noqa: E402
+from mrinufft.io import write_trajectory  # noqa: E402
+
+from quality_utils import load_shared_inputs, run_reconstruction  # noqa: E402
+
+SHAPE = (16, 16, 16)
+
+
+@pytest.fixture
+def cfg(tmp_path):
+    """Return the configuration of a small reconstruction, with its input files."""
+    rng = np.random.default_rng(0)
+    traj = rng.uniform(-0.5, 0.5, (64, 64, 3)).astype(np.float32)
+    write_trajectory(
+        traj,
+        FOV=(0.2, 0.2, 0.2),
+        img_size=SHAPE,
+        grad_filename=str(tmp_path / "traj"),
+        check_constraints=False,
+    )
+    ref_data = np.zeros(SHAPE, dtype=np.complex64)
+    ref_data[4:12, 4:12, 4:12] = 1
+    np.save(tmp_path / "ref.npy", ref_data)
+    return OmegaConf.create(
+        {
+            "cache_dir": str(tmp_path / "cache"),
+            "ref_data": str(tmp_path / "ref.npy"),
+            "trajectory": {"file": str(tmp_path / "traj.bin"), "density": True},
+            "data": {"n_coils": 1},
+            "backend": {"name": "finufft", "eps": 1e-3, "upsampfac": 2.0},
+            "solver": {
+                "optimizer": "pogm",
+                "wavelet": {"base": "haar", "nb_scale": 2},
+                "max_iter": 4,
+            },
+            "convergence": {
+                "enabled": True,
+                "period": 2,
+                "region": "full",
+                "slab_width": 8,
+                "subsample": 4,
+                "cost": False,
+                "targets": {"ssim": [0.5]},
+            },
+            "monitor": {"interval": 0.2, "gpu": False},
+            "profile": {"enabled": False},
+        }
+    )
+
+
+def test_run_reconstruction_caches_spec_rad(cfg, tmp_path, monkeypatch):
+    # The resource monitor writes its log in the working directory.
+    monkeypatch.chdir(tmp_path)
+    shared = load_shared_inputs(cfg)
+    # A fixed threshold: the SURE estimate of pysap-mri uses np.NaN (NumPy < 2).
+    shared.regularizer_op = SparseThreshold(Identity(), 1e-3, thresh_type="soft")
+    for cached in (False, True):
+        output_dir = tmp_path / f"cached_{cached}"
+        output_dir.mkdir()
+        run_reconstruction(cfg, shared, output_dir)
+        (results_file,) = output_dir.glob("results_*.json")
+        with open(results_file) as f:
+            results = json.load(f)
+        assert results["spec_rad_cached"] is cached
+        assert results["spec_rad"] > 0
+        assert results["iteration_time"] > 0
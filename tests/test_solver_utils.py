@@ -0,0 +1,115 @@
+"""Solvers of the quality benchmark, with the convergence tracking."""
+
+import numpy as np
+import pytest
+
+# The gradients of pysap-mri require pysap.
+pytest.importorskip("mri.operators.gradient.gradient")
+
+from modopt.opt.linear import Identity  # noqa: E402
+from modopt.opt.proximity import SparseThreshold  # noqa: E402
+from mrinufft import get_operator  # noqa: E402
+
+from solver_utils import (  # noqa: E402
+    ConvergenceTracker,
+    OPTIMIZERS,
+    WaveletTransform,
+    get_grad_op,
+    initialize_opt,
+    reconstruction_cost,
+)
+
+SHAPE = (16, 16, 16)
+MAX_ITER = 4
+
+
+def make_smaps(n_coils):
+    """Return smooth sensitivity maps, normalized to a unit sum of squares."""
+    grid = np.stack(np.meshgrid(*(np.linspace(-1, 1, n) for n in SHAPE), indexing="ij"))
+    coils = np.arange(n_coils)
+    centers = np.eye(3)[coils % 3] * np.where(coils % 2, -1, 1)[:, None]
+    smaps = np.exp(-np.sum((grid - centers[..., None, None, None]) ** 2, axis=1))
+    smaps = smaps * np.exp(1j * np.pi * coils / n_coils)[:, None, None, None]
+    return (smaps / np.sqrt(np.sum(abs(smaps) ** 2, axis=0))).astype(np.complex64)
+
+
+def make_solver(opt_name, tracker=None, reuse_buffers=True, n_coils=1, **grad_kwargs):
+    """Return a solver of a small 3D reconstruction, and the reference image."""
+    rng = np.random.default_rng(0)
+    traj = rng.uniform(-0.5, 0.5, (4096, 3)).astype(np.float32)
+    ref_data = np.zeros(SHAPE, dtype=np.complex64)
+    ref_data[4:12, 4:12, 4:12] = 1
+    fourier_op = get_operator("finufft")(
+        traj,
+        SHAPE,
+        n_coils=n_coils,
+        smaps=make_smaps(n_coils) if n_coils > 1 else None,
+        density=True,
+        squeeze_dims=True,
+    )
+    linear_op = WaveletTransform("haar", SHAPE, level=2, mode="periodization")
+    prox_op = SparseThreshold(Identity(), 1e-3, thresh_type="soft")
+    synthesis = OPTIMIZERS[opt_name] == "synthesis"
+    grad_op = get_grad_op(
+        fourier_op,
+        OPTIMIZERS[opt_name],
+        linear_op,
+        reuse_buffers=reuse_buffers,
+        **grad_kwargs,
+    )
+    grad_op._obs_data = fourier_op.op(ref_data)
+    if tracker is not None:
+        tracker = ConvergenceTracker(
+            ref_data,
+            period=2,
+            max_iter=MAX_ITER,
+            to_image=linear_op.adj_op if synthesis else None,
+            cost=reconstruction_cost(grad_op, linear_op, prox_op, synthesis),
+        )
+    solver = initialize_opt(
+        opt_name,
+        grad_op,
+        linear_op,
+        prox_op,
+        opt_kwargs={"cost": None, "progress": False},
+        metric_kwargs=tracker.metric_kwargs() if tracker is not None else None,
+    )
+    return solver, tracker
+
+
+@pytest.mark.parametrize("n_coils", [1, 4])
+@pytest.mark.parametrize("opt_name", ["pogm", "fista"])
+def test_convergence_tracker(opt_name, n_coils):
+    solver, tracker = make_solver(opt_name, tracker=True, n_coils=n_coils)
+    tracker.start()
+    solver.iterate(max_iter=MAX_ITER)
+    assert [r["iteration"] for r in tracker.records] == [2, 4]
+    for record in tracker.records:
+        assert np.isfinite([record["cost"], record["snr"], record["ssim"]]).all()
+    assert tracker.records[-1]["cost"] <= tracker.records[0]["cost"]
+
+
+def test_convergence_tracker_maps_recorded_iterations():
+    solver, tracker = make_solver("pogm", tracker=True)
+    to_image, calls = tracker.to_image, []
+    tracker.to_image = lambda coeffs: calls.append(1) or to_image(coeffs)
+    tracker.start()
+    solver.iterate(max_iter=MAX_ITER)
+    # The wavelet synthesis is not run at the iterations without record.
+    assert len(calls) == len(tracker.records) < MAX_ITER
+
+
+def test_reuse_buffers_pogm():
+    solver, _ = make_solver("pogm", reuse_buffers=False)
+    # Same step size: the power method starts from a random image.
+    reuse_solver, _ = make_solver(
+        "pogm", reuse_buffers=True, lipschitz_cst=solver._grad.spec_rad
+    )
+    grad = reuse_solver._grad.grad
+    solver.iterate(max_iter=MAX_ITER)
+    reuse_solver.iterate(max_iter=MAX_ITER)
+    np.testing.assert_allclose(reuse_solver.x_final, solver.x_final, rtol=1e-5)
+    # The gradients are written in the same coefficients...
+    assert reuse_solver._grad.grad is grad
+    # ...but POGM compares each gradient with the previous one for its restart.
+    assert not np.shares_memory(reuse_solver._g_old, grad)
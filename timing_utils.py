@@ -0,0 +1,154 @@
+"""Adaptive repetition of the timed benchmark runs.
+
+The number of runs is not fixed: after the warm-up runs (which are discarded),
+the task is repeated until the confidence interval of the median run time is
+narrow enough, within a minimum/maximum number of runs and a time budget.
+"""
+
+import time
+from statistics import NormalDist
+
+import numpy as np
+
+
+class TimingEngine:
+    """Decide how many times a task is run, and summarize the run times.
+
+    Parameters
+    ----------
+    warmup: int, default 1
+        Number of initial runs discarded from the statistics.
+    min_runs: int, default 5
+        Minimum number of kept runs.
+    max_runs: int, default 100
+        Maximum number of kept runs.
+    max_time: float, default 10.0
+        Time budget in seconds, checked once ``min_runs`` is reached.
+    target_rel_ci: float, default 0.05
+        Stop when the half-width of the confidence interval of the median,
+        relative to the median, is below this value.
+    confidence: float, default 0.95
+        Confidence level of the interval.
+    outlier_threshold: float, default 1.5
+        Runs outside ``[Q1 - t * IQR, Q3 + t * IQR]`` are rejected.
+        No rejection if None or 0.
+
+    Example
+    -------
+    >>> engine = TimingEngine(warmup=1, min_runs=5)
+    >>> for i, warmup in engine.runs():
+    ...     engine.record(run_time(task))
+    >>> engine.summary()["median"]
+    """
+
+    def __init__(
+        self,
+        warmup: int = 1,
+        min_runs: int = 5,
+        max_runs: int = 100,
+        max_time: float = 10.0,
+        target_rel_ci: float = 0.05,
+        confidence: float = 0.95,
+        outlier_threshold: float | None = 1.5,
+    ):
+        if min_runs < 1 or max_runs < min_runs:
+            raise ValueError("Requires 1 <= min_runs <= max_runs.")
+        self.warmup = warmup
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.max_time = max_time
+        self.target_rel_ci = target_rel_ci
+        self.confidence = confidence
+        self.outlier_threshold = outlier_threshold
+        self.times = []
+        self.warmup_times = []
+
+    @classmethod
+    def from_config(cls, cfg, **overrides):
+        """Create the engine from the ``timing`` section of a config."""
+        return cls(**(dict(cfg) | overrides))
+
+    def runs(self):
+        """Yield the run index and whether it is a warm-up run."""
+        self.times = []
+        self.warmup_times = []
+        tic = time.perf_counter()
+        for i in range(self.warmup):
+            yield i, True
+        i = self.warmup
+        while len(self.times) < self.max_runs:
+            n_runs = len(self.times)
+            if n_runs >= self.min_runs and (
+                time.perf_counter() - tic >= self.max_time or self.converged()
+            ):
+                break
+            yield i, False
+            i += 1
+
+    def record(self, run_time: float) -> None:
+        """Record the run time of the current run."""
+        if len(self.warmup_times) < self.warmup:
+            self.warmup_times.append(run_time)
+        else:
+            self.times.append(run_time)
+
+    def converged(self) -> bool:
+        """Check if the median run time is known precisely enough."""
+        summary = self.summary()
+        return summary["rel_ci"] <= self.target_rel_ci
+
+    def outliers(self) -> np.ndarray:
+        """Return the mask of the rejected runs, among the kept runs."""
+        return outlier_mask(self.times, self.outlier_threshold)
+
+    def summary(self) -> dict[str, float]:
+        """Summarize the run times, without the warm-up runs and outliers."""
+        times = np.asarray(self.times)
+        return summarize(times[~self.outliers()], self.confidence)
+
+
+def outlier_mask(values, threshold: float | None = 1.5) -> np.ndarray:
+    """Return the mask of the values outside the Tukey fences."""
+    values = np.asarray(values, dtype=float)
+    if not threshold or values.size < 4:
+        return np.zeros(values.shape, dtype=bool)
+    q1, q3 = np.percentile(values, [25, 75])
+    iqr = q3 - q1
+    return (values < q1 - threshold * iqr) | (values > q3 + threshold * iqr)
+
+
+def summarize(values, confidence: float = 0.95) -> dict[str, float]:
+    """Return the median, IQR and confidence interval of the median.
+
+    The confidence interval is distribution-free, using the order statistics
+    given by the normal approximation of the binomial distribution.
+    """
+    values = np.sort(np.asarray(values, dtype=float))
+    n = values.size
+    if n == 0:
+        return {
+            "n_runs": 0,
+            "median": np.nan,
+            "q1": np.nan,
+            "q3": np.nan,
+            "iqr": np.nan,
+            "ci_low": np.nan,
+            "ci_high": np.nan,
+            "rel_ci": np.inf,
+        }
+    median = np.median(values)
+    q1, q3 = np.percentile(values, [25, 75])
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    low = int(np.clip(round(n / 2 - z * np.sqrt(n) / 2) - 1, 0, n - 1))
+    high = int(np.clip(round(1 + n / 2 + z * np.sqrt(n) / 2) - 1, 0, n - 1))
+    ci_low, ci_high = values[low], values[high]
+    return {
+        "n_runs": n,
+        "median": median,
+        "q1": q1,
+        "q3": q3,
+        "iqr": q3 - q1,
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+        "rel_ci": (ci_high - ci_low) / (2 * median) if median > 0 else np.inf,
+    }
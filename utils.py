@@ -1,9 +1,437 @@
 """Utility for the benchmark."""
-import numpy as np
+import importlib.abc
+import logging
 import os
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+
+from cache_utils import (
+    array_hash,
+    cache_path,
+    cached_array,
+    load_cached,
+    load_sidecar,
+    save_cached,
+)
+from memory_utils import PeakMemory
+
+logger = logging.getLogger(__name__)
 
 AnyShape = tuple[int, ...]
 
+# Precision of the finufft operator simulating the reference k-space.
+REF_EPS = 6e-8
+
+# Density estimators of mrinufft.density requiring the image shape.
+_DENSITY_WITH_SHAPE = {"pipe", "cell_count"}
+
+# Frameworks and libraries imported by each mrinufft backend. Importing
+# mrinufft tries all of them, the ones of the other backends can be blocked.
+BACKEND_MODULES = {
+    "finufft": ("finufft",),
+    "cufinufft": ("cupy", "cupyx", "cufinufft"),
+    "gpunufft": ("cupy", "cupyx", "gpuNUFFT"),
+    "tensorflow": ("tensorflow", "tensorflow_nufft", "tensorflow_mri"),
+    "torchkbnufft-cpu": ("torch", "torchkbnufft"),
+    "torchkbnufft-gpu": ("torch", "torchkbnufft", "cupy", "cupyx"),
+    "sigpy": ("sigpy",),
+    "pynufft-cpu": ("pynufft",),
+    "pynfft": ("pyNFFT3",),
+    "ducc0": ("ducc0",),
+    "numpy": (),
+}
+
+
+def load_trajectory(
+    file: str | os.PathLike,
+    dtype: np.dtype = np.float32,
+    cachedir: str | os.PathLike | None = None,
+    max_cache_size_GiB: float | None = None,
+) -> tuple[np.ndarray, dict]:
+    """Load a trajectory file, through a memory-mapped cache.
+
+    The ``.bin`` file is read once and converted to a ``.npy`` file of the
+    requested dtype, with its parameters in a JSON sidecar. Later loads open
+    it with ``mmap_mode="r"``, so concurrent jobs share the same pages.
+
+    Parameters
+    ----------
+    file
+        Path of the trajectory ``.bin`` file.
+    dtype
+        Datatype of the returned trajectory.
+    cachedir
+        Directory of the trajectory cache. If None, the file is read directly.
+    max_cache_size_GiB
+        Disk budget of the cache, least recently used entries are evicted beyond it.
+
+    Returns
+    -------
+    np.ndarray
+        The trajectory (read-only if cached).
+    dict
+        The trajectory parameters.
+    """
+    file = Path(file).resolve()
+    if cachedir is None:
+        from mrinufft.io import read_trajectory
+
+        trajectory, params = read_trajectory(str(file))
+        return trajectory.astype(dtype, copy=False), params
+
+    stat = file.stat()
+    path = cache_path(
+        cachedir,
+        f"traj_{file.stem}",
+        dict(
+            file=str(file),
+            size=stat.st_size,
+            mtime=stat.st_mtime_ns,
+            dtype=np.dtype(dtype).name,
+        ),
+    )
+    trajectory = load_cached(path)
+    if trajectory is not None:
+        return trajectory, load_sidecar(path)
+
+    logger.info(f"Cache miss for {file.name}, converting it.")
+    from mrinufft.io import read_trajectory
+
+    trajectory, params = read_trajectory(str(file))
+    save_cached(
+        path,
+        trajectory.astype(dtype, copy=False),
+        sidecar=params,
+        max_size_GiB=max_cache_size_GiB,
+    )
+    return load_cached(path), load_sidecar(path)
+
+
+class _BlockedModules(importlib.abc.MetaPathFinder):
+    """Import hook failing the import of some top-level modules."""
+
+    def __init__(self, names):
+        self.names = set(names)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname.partition(".")[0] in self.names:
+            raise ModuleNotFoundError(f"{fullname} is blocked", name=fullname)
+        return None
+
+
+def block_frameworks(backend: str) -> list[str]:
+    """Prevent the import of the frameworks not needed by a backend.
+
+    Must be called before importing mrinufft: its interfaces then fail to
+    import the blocked modules and mark their backend as unavailable. Nothing
+    is blocked for the backends missing from ``BACKEND_MODULES`` (like the
+    stacked ones, which wrap another backend). The modules are not set to None
+    in ``sys.modules``, some libraries (scipy) look them up there.
+
+    Returns
+    -------
+    list[str]
+        The blocked modules.
+    """
+    if backend not in BACKEND_MODULES:
+        return []
+    needed = set(BACKEND_MODULES[backend])
+    blocked = sorted(
+        {name for modules in BACKEND_MODULES.values() for name in modules}
+        - needed
+        - set(sys.modules)
+    )
+    sys.meta_path.insert(0, _BlockedModules(blocked))
+    return blocked
+
+
+def process_uptime() -> float | None:
+    """Return the time elapsed since the start of the process, None if unknown.
+
+    The start time of ``/proc/self/stat`` is in clock ticks since the boot
+    (Linux only), with a resolution of ``1 / SC_CLK_TCK`` (usually 10 ms).
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # The fields after the command name, the start time is the 22nd.
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        start = start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - start
+    except (OSError, AttributeError, ValueError, IndexError):
+        return None
+
+
+def generate_trajectory(
+    name: str,
+    shape: AnyShape,
+    kwargs: dict | None = None,
+    nb_stacks: int | None = None,
+    dtype: np.dtype = np.float32,
+    cachedir: str | os.PathLike | None = None,
+    max_cache_size_GiB: float | None = None,
+) -> tuple[np.ndarray, dict]:
+    """Generate a trajectory with an initializer of ``mrinufft.trajectories``.
+
+    Parameters
+    ----------
+    name
+        Name of the initializer, like ``initialize_3D_floret``.
+    shape
+        Shape of the image.
+    kwargs
+        Arguments of the initializer, like ``Nc`` and ``Ns``.
+    nb_stacks
+        If given, the (2D) trajectory is stacked along the last axis.
+    dtype
+        Datatype of the returned trajectory.
+    cachedir
+        Directory of the trajectory cache. If None, nothing is cached.
+    max_cache_size_GiB
+        Disk budget of the cache, least recently used entries are evicted beyond it.
+
+    Returns
+    -------
+    np.ndarray
+        The trajectory, in [-0.5, 0.5) (read-only if cached).
+    dict
+        The trajectory parameters, with the same ``img_size`` key as the files.
+    """
+    kwargs = dict(kwargs or {})
+    params = dict(
+        name=name,
+        img_size=[int(s) for s in shape],
+        kwargs=kwargs,
+        nb_stacks=nb_stacks,
+        dtype=np.dtype(dtype).name,
+    )
+
+    def generate():
+        # Imported on a cache miss only: mrinufft imports all its backends.
+        import mrinufft.trajectories
+
+        trajectory = getattr(mrinufft.trajectories, name)(**kwargs)
+        if nb_stacks is not None:
+            trajectory = mrinufft.trajectories.stack(trajectory, nb_stacks)
+        return trajectory.astype(dtype, copy=False)
+
+    if cachedir is None:
+        return generate(), params
+    path = cache_path(cachedir, f"traj_{name}", params)
+    trajectory = load_cached(path)
+    if trajectory is None:
+        save_cached(path, generate(), sidecar=params, max_size_GiB=max_cache_size_GiB)
+        trajectory = load_cached(path)
+    return trajectory, load_sidecar(path)
+
+
+def trajectory_name(trajectory_cfg) -> str:
+    """Return the short name of a trajectory file or initializer config."""
+    if isinstance(trajectory_cfg, str):
+        return trajectory_cfg.split("/")[-1].split("_")[0]
+    # initialize_3D_floret -> floret
+    name = trajectory_cfg["name"].split("_", 2)[-1]
+    if trajectory_cfg.get("nb_stacks"):
+        name = f"stack_of_{name}"
+    return name
+
+
+def random_complex(
+    shape: AnyShape,
+    dtype: np.dtype = np.complex64,
+    rng: np.random.Generator | None = None,
+    distribution: str = "normal",
+    chunk_size: int = 2**24,
+    out: np.ndarray | None = None,
+) -> np.ndarray:
+    """Generate random complex data directly in the target dtype.
+
+    The real and imaginary parts are drawn chunk by chunk in a preallocated
+    complex array, without any float64 temporary.
+
+    Parameters
+    ----------
+    shape
+        Shape of the array.
+    dtype
+        Complex datatype of the array.
+    rng
+        Random generator, default to ``np.random.default_rng()``.
+    distribution
+        "normal" (standard normal) or "uniform" (in [0, 1)) real and imaginary parts.
+    chunk_size
+        Number of real values drawn at once.
+    out
+        Preallocated output array.
+
+    Returns
+    -------
+    np.ndarray
+        The random complex array.
+    """
+    dtype = np.dtype(dtype)
+    real_dtype = np.finfo(dtype).dtype
+    if rng is None:
+        rng = np.random.default_rng()
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    if distribution == "normal":
+        draw = rng.standard_normal
+    elif distribution == "uniform":
+        draw = rng.random
+    else:
+        raise ValueError(f"Unknown distribution {distribution}")
+    # Interleaved real and imaginary parts, no copy.
+    flat = out.reshape(-1).view(real_dtype)
+    for start in range(0, flat.size, chunk_size):
+        draw(dtype=real_dtype, out=flat[start : start + chunk_size])
+    return out
+
+
+def reference_kspace(
+    trajectory: np.ndarray,
+    ref_data: np.ndarray,
+    eps: float = REF_EPS,
+    n_coils: int = 1,
+    smaps: np.ndarray | None = None,
+    cachedir: str | os.PathLike | None = None,
+    max_cache_size_GiB: float | None = None,
+    **kwargs,
+) -> np.ndarray:
+    """Simulate the k-space of a reference image with a high precision NUFFT.
+
+    The result is cached, keyed on the hashes of the trajectory, the reference
+    image and the sensitivity maps, the precision and the number of coils.
+
+    Parameters
+    ----------
+    trajectory
+        The trajectory, in [-0.5, 0.5).
+    ref_data
+        The reference image.
+    eps
+        Precision of the finufft operator.
+    n_coils
+        Number of coils.
+    smaps
+        Sensitivity maps of the coils, if n_coils > 1.
+    cachedir
+        Directory of the k-space cache. If None, nothing is cached.
+    max_cache_size_GiB
+        Disk budget of the cache, least recently used entries are evicted beyond it.
+    **kwargs
+        Extra arguments of the finufft operator, like ``nthreads``.
+
+    Returns
+    -------
+    np.ndarray
+        The k-space data (read-only if cached).
+    """
+    from mrinufft import get_operator
+
+    def simulate():
+        nufft = get_operator("finufft")(
+            trajectory,
+            ref_data.shape,
+            n_coils=n_coils,
+            smaps=smaps,
+            density=False,
+            eps=eps,
+            **kwargs,
+        )
+        return nufft.op(np.asarray(ref_data))
+
+    if cachedir is None:
+        return simulate()
+    params = dict(
+        trajectory=array_hash(trajectory),
+        ref_data=array_hash(ref_data),
+        eps=float(eps),
+        n_coils=int(n_coils),
+        smaps=None if smaps is None else array_hash(smaps),
+    )
+    path = cache_path(cachedir, "ksp", params)
+    ksp_data = load_cached(path)
+    if ksp_data is None:
+        logger.info(f"Cache miss for {path.name}, simulating the k-space.")
+        save_cached(path, simulate(), sidecar=params, max_size_GiB=max_cache_size_GiB)
+        ksp_data = load_cached(path)
+    return ksp_data
+
+
+def compute_density(
+    trajectory: np.ndarray,
+    shape: AnyShape,
+    method: str,
+    cachedir: str | os.PathLike | None = None,
+    max_cache_size_GiB: float | None = None,
+    **kwargs,
+) -> tuple[np.ndarray, dict]:
+    """Estimate the density compensation weights of a trajectory, with a cache.
+
+    The weights are cached, keyed on the hash of the trajectory, the method,
+    the shape and the extra arguments. The run time and peak memory of the
+    estimation are stored with the weights, so they are known on cache hits.
+
+    Parameters
+    ----------
+    trajectory
+        The trajectory, in [-0.5, 0.5).
+    shape
+        Shape of the image.
+    method
+        Name of a ``mrinufft.density`` method ("voronoi", "pipe", "cell_count").
+    cachedir
+        Directory of the density cache. If None, nothing is cached.
+    max_cache_size_GiB
+        Disk budget of the cache, least recently used entries are evicted beyond it.
+    **kwargs
+        Extra arguments of the method, like ``backend`` for "pipe".
+
+    Returns
+    -------
+    np.ndarray
+        The real density weights (read-only if cached).
+    dict
+        The ``method``, the ``run_time`` and peak memory (``mem_hwm`` and
+        ``mem_delta``, in GiB) of the estimation, and ``cached``.
+    """
+    from mrinufft.density import get_density
+
+    def estimate():
+        args = (shape,) if method in _DENSITY_WITH_SHAPE else ()
+        peak_memory = PeakMemory() if PeakMemory.supported() else None
+        tic = time.perf_counter()
+        with peak_memory or nullcontext():
+            weights = get_density(method, trajectory, *args, **kwargs)
+        info = {"method": method, "run_time": time.perf_counter() - tic}
+        if peak_memory is not None:
+            info |= peak_memory.values
+        return np.real(weights).astype(np.float32), info
+
+    if cachedir is None:
+        weights, info = estimate()
+        return weights, info | {"cached": False}
+    params = dict(
+        trajectory=array_hash(trajectory),
+        shape=[int(s) for s in shape],
+        method=method,
+        kwargs=kwargs,
+    )
+    path = cache_path(cachedir, f"density_{method}", params)
+    weights = load_cached(path)
+    if weights is not None:
+        return weights, load_sidecar(path)["info"] | {"cached": True}
+    logger.info(f"Cache miss for {path.name}, estimating the density.")
+    weights, info = estimate()
+    save_cached(
+        path, weights, sidecar=params | {"info": info}, max_size_GiB=max_cache_size_GiB
+    )
+    return load_cached(path), info | {"cached": False}
+
 
 def get_smaps(
     shape: AnyShape,
@@ -11,6 +439,7 @@ def get_smaps(
     antenna: str = "birdcage",
     dtype: np.dtype = np.complex64,
     cachedir="/tmp/smaps",
+    max_cache_size_GiB: float | None = None,
 ) -> np.ndarray:
     """Get sensitivity maps for a specific antenna.
 
@@ -24,24 +453,55 @@ def get_smaps(
         name of the antenna to emulate. Only "birdcage" is currently supported.
     dtype
         return datatype for the sensitivity maps.
+    cachedir
+        Directory to cache the sensitivity maps.
+    max_cache_size_GiB
+        Disk budget of the cache, least recently used maps are evicted beyond it.
+
+    Returns
+    -------
+    np.ndarray
+        Read-only memory-mapped sensitivity maps.
     """
     if antenna == "birdcage":
-        try:
-            os.makedirs(cachedir, exist_ok=True)
-            smaps = np.load(f"{cachedir}/smaps_{n_coils}_{shape}.npy")
-        except FileNotFoundError:
-            smaps = _birdcage_maps((n_coils, *shape), nzz=n_coils, dtype=dtype)
-            np.save(f"{cachedir}/smaps_{n_coils}_{shape}.npy", smaps)
-        return smaps
+        shape = tuple(int(s) for s in shape)
+        r, nzz = 1.5, n_coils
+        params = dict(
+            antenna=antenna,
+            shape=shape,
+            n_coils=n_coils,
+            dtype=np.dtype(dtype).name,
+            r=r,
+            nzz=nzz,
+        )
+        maps_shape = tuple(s for s in (n_coils, *shape) if s != 1)
+        return cached_array(
+            cachedir,
+            "smaps",
+            params,
+            maps_shape,
+            dtype,
+            lambda out: _birdcage_maps(
+                (n_coils, *shape), r=r, nzz=nzz, dtype=dtype, out=out
+            ),
+            max_size_GiB=max_cache_size_GiB,
+        )
     else:
         raise NotImplementedError
 
 
 def _birdcage_maps(
-    shape: AnyShape, r: float = 1.5, nzz: int = 8, dtype: np.dtype = np.complex64
+    shape: AnyShape,
+    r: float = 1.5,
+    nzz: int = 8,
+    dtype: np.dtype = np.complex64,
+    out: np.ndarray | None = None,
 ) -> np.ndarray:
     """Simulate birdcage coil sensitivies.
 
+    The maps are generated one coil at a time, directly in the target dtype, so
+    that the peak memory stays close to the size of the returned array.
+
     Parameters
     ----------
     shape
@@ -51,6 +511,10 @@ def _birdcage_maps(
     nzz
         number of coils per ring.
     dtype
+        datatype of the sensitivity maps.
+    out
+        Preallocated (possibly memory-mapped) output array, of shape ``shape``
+        with singleton dimensions squeezed.
 
     Returns
     -------
@@ -67,21 +531,45 @@ def _birdcage_maps(
         nz = 1
     else:
         raise ValueError("shape must be [nc, nx, ny, nz] or [nc, nx, ny]")
-    c, z, y, x = np.mgrid[:nc, :nz, :ny, :nx]
-
-    coilx = r * np.cos(c * (2 * np.pi / nzz), dtype=np.float32)
-    coily = r * np.sin(c * (2 * np.pi / nzz), dtype=np.float32)
-    coilz = np.floor(np.float32(c / nzz)) - 0.5 * (np.ceil(nc / nzz) - 1)
-    coil_phs = np.float32(-(c + np.floor(c / nzz)) * (2 * np.pi / nzz))
-
-    x_co = (x - nx / 2.0) / (nx / 2.0) - coilx
-    y_co = (y - ny / 2.0) / (ny / 2.0) - coily
-    z_co = (z - nz / 2.0) / (nz / 2.0) - coilz
-    rr = (x_co ** 2 + y_co ** 2 + z_co ** 2) ** 0.5
-    phi = np.arctan2(x_co, -y_co) + coil_phs
-    out = (1 / rr) * np.exp(1j * phi)
-
-    rss = sum(abs(out) ** 2, 0) ** 0.5
-    out /= rss
-    out = np.squeeze(out)
-    return out.astype(dtype)
+    dtype = np.dtype(dtype)
+    real_dtype = np.finfo(dtype).dtype
+    out_shape = tuple(s for s in (nc, nz, ny, nx) if s != 1)
+    if out is None:
+        out = np.empty(out_shape, dtype=dtype)
+    elif out.shape != out_shape or out.dtype != dtype:
+        raise ValueError(f"out must be a {dtype} array of shape {out_shape}")
+    # View with explicit singleton dimensions, no copy.
+    maps = out.reshape(nc, nz, ny, nx)
+
+    z = np.arange(nz, dtype=real_dtype).reshape(-1, 1, 1)
+    y = np.arange(ny, dtype=real_dtype).reshape(1, -1, 1)
+    x = np.arange(nx, dtype=real_dtype).reshape(1, 1, -1)
+    z = (z - real_dtype.type(nz / 2.0)) / real_dtype.type(nz / 2.0)
+    y = (y - real_dtype.type(ny / 2.0)) / real_dtype.type(ny / 2.0)
+    x = (x - real_dtype.type(nx / 2.0)) / real_dtype.type(nx / 2.0)
+
+    rss = np.zeros((nz, ny, nx), dtype=real_dtype)
+    inv_rr = np.empty((nz, ny, nx), dtype=real_dtype)
+    for c in range(nc):
+        coilx = r * np.cos(c * (2 * np.pi / nzz))
+        coily = r * np.sin(c * (2 * np.pi / nzz))
+        coilz = np.floor(c / nzz) - 0.5 * (np.ceil(nc / nzz) - 1)
+        coil_phs = -(c + np.floor(c / nzz)) * (2 * np.pi / nzz)
+
+        x_co = x - real_dtype.type(coilx)
+        y_co = y - real_dtype.type(coily)
+        z_co = z - real_dtype.type(coilz)
+        # |out|**2 = 1 / rr**2, accumulated for the root sum of squares.
+        np.add(x_co**2 + y_co**2, z_co**2, out=inv_rr)
+        np.reciprocal(inv_rr, out=inv_rr)
+        rss += inv_rr
+        np.sqrt(inv_rr, out=inv_rr)
+        phi = np.arctan2(x_co, -y_co) + real_dtype.type(coil_phs)
+        maps[c] = np.exp(1j * phi).astype(dtype, copy=False)
+        maps[c] *= inv_rr
+
+    np.sqrt(rss, out=rss)
+    np.reciprocal(rss, out=rss)
+    for c in range(nc):
+        maps[c] *= rss
+    return out